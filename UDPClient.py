@@ -1,166 +1,476 @@
-from socket import *
+from socket import socket, timeout, AF_INET, SOCK_DGRAM
 from protocol import (
     unpack_packet,
     pack_packet,
     FLAG_DATA,
     FLAG_ACK,
     FLAG_TEST_ERR,
+    FLAG_PRESENCE,
+    FLAG_RESET,
     WINDOW_SIZE,
+    PROTOCOL_V1,
+    PROTOCOL_VERSION,
 )
+from sendwindow import SendRing
+from presence import decode_deltas, HEARTBEAT, TYPING_ON, TYPING_OFF
+import os
 import time
 import sys
 import threading
-import traceback
-
-try:
-    sys.stdout.reconfigure(encoding="utf-8")
-except Exception:
-    pass
 
 SERVER_NAME = "localhost"
 SERVER_PORT = 12000
 TIMEOUT = 4.0
+HEARTBEAT_INTERVAL = 5.0  # presença: "ainda estou aqui" para o servidor
+V2_RETRY_INTERVAL = 30.0  # após cair para v1 por silêncio, tenta v2 de novo
+V2_RETRY_MAX = 600.0  # teto do backoff entre tentativas
 
 
-def removePackagesReceivedUpTo(base, packages):
-    for seq in list(packages.keys()):
-        if seq < base:
-            del packages[seq]
+def _noop(*_args):
+    pass
 
 
 class State:
     def __init__(self):
-        self.base = 1
-        self.nextSequenceNumber = 1
-        self.packages = {}
+        self.window = SendRing(WINDOW_SIZE)  # pacotes em trânsito (base..next)
         self.timer_start = None
         self.peer_window = WINDOW_SIZE
         self.lock = threading.Lock()
+        # Serializa os envios (reserva → sendto) para os SEQs saírem em ordem;
+        # a thread receptora só o pega na troca de versão (_use_version).
+        self.send_lock = threading.Lock()
 
         self.test_error = False
         self.test_drop_packet = False
         self.test_drop_ack = False
 
 
-def receiver_loop(sock: socket, st: State, serverAddress):
-    sock.settimeout(0.5)
+class ChatClient:
+    """
+    Motor do cliente (importável): socket, janela de envio e thread receptora.
+    Eventos (chamados na thread receptora):
+    - on_message(sender, text): mensagem de chat encaminhada pelo servidor
+    - on_ack(ack): ACK cumulativo que avançou a base da janela
+    - on_status(text): avisos do sistema, do servidor e dos modos de teste
+    - on_presence(deltas): lote [(op, nome), ...] de presença/digitando
+    Protocolo: começa em `version` e cai para v1 se o servidor responder em v1.
+    Se o servidor nunca responder, a queda para v1 é provisória: com a janela
+    vazia o cliente volta a tentar `version` (backoff de V2_RETRY_INTERVAL até
+    V2_RETRY_MAX) até uma resposta confirmar a versão.
+    Com `key` a sessão é autenticada (v2 + MAC, sem fallback).
+    """
+
+    def __init__(
+        self,
+        server_address=(SERVER_NAME, SERVER_PORT),
+        on_message=None,
+        on_ack=None,
+        on_status=None,
+        on_presence=None,
+        version: int = PROTOCOL_VERSION,
+        key: bytes | None = None,
+    ):
+        self.server_address = server_address
+        self.version = version
+        self.key = key
+        self._heard_server = False
+        self._preferred = version
+        self._fallback = False  # v1 provisório (caiu por silêncio, não por resposta)
+        self._retry_at = 0.0
+        self._retry_interval = V2_RETRY_INTERVAL
+        self.on_message = on_message or _noop
+        self.on_ack = on_ack or _noop
+        self.on_status = on_status or _noop
+        self.on_presence = on_presence or _noop
+        self._typing = False
+        self._last_heartbeat = time.monotonic()
+        self._login = None  # payload da 1ª mensagem (username), para refazer login
+        self._reset_at = float("-inf")
+
+        self.st = State()
+        self.sock = socket(AF_INET, SOCK_DGRAM)
+        self._running = False
+        self._thread = None
+
+    # ------- ciclo de vida -------
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._receiver_loop, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._running = False
+        try:
+            self.sock.close()
+        except Exception:
+            pass
+
+    # ------- modos de teste -------
+    # Flags simples: atribuição é atômica, não precisam do lock
+    def set_test_error(self, val: bool):
+        self.st.test_error = val
+        self.on_status(f"[SISTEMA] Erro: {'ATIVADO' if val else 'DESATIVADO'}")
 
-    while True:
+    def set_drop_packet(self, val: bool):
+        self.st.test_drop_packet = val
+        self.on_status(
+            f"[SISTEMA] Descarte de Pacotes: {'ATIVADO' if val else 'DESATIVADO'}"
+        )
+
+    def set_drop_ack(self, val: bool):
+        self.st.test_drop_ack = val
+        self.on_status(
+            f"[SISTEMA] Descarte de ACKs: {'ATIVADO' if val else 'DESATIVADO'}"
+        )
+
+    # ------- presença -------
+    def _send_presence(self, payload: bytes):
+        # Sem SEQ e sem buffer: se perder, o próximo heartbeat corrige (ele
+        # leva o estado de digitação atual, ver _receiver_loop)
+        pkt = pack_packet(
+            version=self.version,
+            flags=FLAG_PRESENCE,
+            seq=0,
+            ack=0,
+            window_size=WINDOW_SIZE,
+            payload=payload,
+            key=self.key,
+        )
         try:
-            datagram, addr = sock.recvfrom(2048)
-        except timeout:
-            datagram = None
+            self.sock.sendto(pkt, self.server_address)
         except OSError:
-            break
-        except Exception as e:
-            print(f"[ERRO DE DEBUG] Falha no recvfrom: {e}")
-            datagram = None
+            pass
 
-        if datagram:
-            try:
-                pkt = unpack_packet(datagram)
-
-                if not pkt["checksum_ok"]:
-                    continue
-
-                with st.lock:
-                    # [TESTE] Descarte de Pacotes (Simulação)
-                    should_drop = False
-                    if (pkt["flags"] & FLAG_DATA) and st.test_drop_packet:
-                        print(
-                            f"\n[TEST] Pacote SEQ={pkt['seq']} recebido mas DESCARTADO (Drop Packet)."
-                        )
-                        should_drop = True
-
-                    # Se NÃO for dropado, processa e MANDA ACK
-                    if not should_drop:
-                        st.peer_window = pkt.get("win", WINDOW_SIZE)
-
-                        if pkt["flags"] & FLAG_DATA:
-                            if pkt["payload"]:
-                                msg = pkt["payload"].decode(errors="ignore").strip()
-                                if msg:
-                                    print(f"\n{msg}")
-
-                            # [NOVO] CLIENTE AGORA RESPONDE COM ACK AO SERVIDOR
-                            # Sem isso, o servidor não saberia que chegou e retransmitiria pra sempre.
-                            ack_pkt = pack_packet(
-                                version=1,
-                                flags=FLAG_ACK,
-                                seq=0,
-                                ack=pkt["seq"],  # Confirma o SEQ recebido do server
-                                window_size=WINDOW_SIZE,
-                                payload=b"",
-                            )
-                            sock.sendto(ack_pkt, serverAddress)
-
-                        # [TESTE] Descarte de ACK (Simulação)
-                        acknum = pkt.get("ack", None)
-                        dropped_ack = False
-                        if (
-                            acknum is not None
-                            and (pkt["flags"] & FLAG_ACK)
-                            and not (pkt["flags"] & FLAG_DATA)
-                        ):
-                            if st.test_drop_ack:
-                                print(
-                                    f"\n[TEST] ACK={acknum} recebido mas IGNORADO (Drop ACK)."
-                                )
-                                dropped_ack = True
-
-                        if (not dropped_ack) and acknum is not None:
-                            if acknum >= st.base - 1:
-                                st.base = acknum + 1
-                                removePackagesReceivedUpTo(st.base, st.packages)
-
-                                if st.base == st.nextSequenceNumber:
-                                    st.timer_start = None
-                                else:
-                                    st.timer_start = time.monotonic()
+    def set_typing(self, on: bool):
+        """
+        Avisa o servidor que começou/parou de digitar (só na mudança).
+        O estado também vai em todo heartbeat, então um aviso perdido se corrige.
+        """
+        if on == self._typing:
+            return
+        self._typing = on
+        self._send_presence(TYPING_ON if on else TYPING_OFF)
+
+    # ------- envio -------
+    # st.lock protege só a janela (índices + slots) e o timer: a thread
+    # receptora não espera por pack_packet, sendto ou callbacks (exceto na
+    # rara troca de versão, que precisa da janela parada).
+    # st.send_lock segura reserva → sendto para que dois chamadores não
+    # ponham SEQ N+1 no fio antes de N (o servidor é Go-Back-N).
+    def send(self, text: str) -> bool:
+        """Envia uma mensagem. Retorna False se a janela estiver cheia."""
+        st = self.st
+        payload = text.encode()
+
+        with st.send_lock:
+            # 1) reserva o SEQ
+            with st.lock:
+                janela_efetiva = min(WINDOW_SIZE, st.peer_window)
+                seq = None
+                if st.window.in_flight() < janela_efetiva:
+                    seq = st.window.reserve()
+            if seq is None:
+                self.on_status("Janela cheia. Aguarde ACKs.")
+                return False
+            if self._login is None:
+                self._login = payload
+
+            # 2) monta os pacotes sem segurar o lock da janela
+            # Pacote limpo para buffer
+            pkt_clean = pack_packet(
+                version=self.version,
+                flags=FLAG_DATA,
+                seq=seq,
+                ack=0,
+                window_size=WINDOW_SIZE,
+                payload=payload,
+                key=self.key,
+            )
+
+            # Pacote para envio (pode ter erro)
+            pkt_to_send = pkt_clean
+            if st.test_error:
+                self.on_status(f"[TEST] Gerando versão CORROMPIDA para SEQ={seq}...")
+                pkt_to_send = pack_packet(
+                    version=self.version,
+                    flags=FLAG_DATA | FLAG_TEST_ERR,
+                    seq=seq,
+                    ack=0,
+                    window_size=WINDOW_SIZE,
+                    payload=payload,
+                    key=self.key,
+                )
 
+            # 3) publica no buffer de retransmissão
+            with st.lock:
+                st.window.put(seq, pkt_clean)
+                if st.timer_start is None:
+                    st.timer_start = time.monotonic()
+
+            # 4) syscall fora do lock da janela, mas ainda na ordem do SEQ
+            try:
+                self.sock.sendto(pkt_to_send, self.server_address)
             except Exception as e:
-                print(f"\n[ERRO CRÍTICO] Falha ao processar pacote: {e}")
-                traceback.print_exc()
+                # SEQ já está no buffer: o timeout retransmite
+                self.on_status(f"Erro ao enviar: {e}")
+        return True
+
+    # ------- recepção -------
+    def _deliver(self, msg: str):
+        # Servidor encaminha no formato "nome|mensagem"; o resto é aviso
+        if "|" in msg and not msg.startswith("["):
+            nome, texto = msg.split("|", 1)
+            self.on_message(nome.strip() or "desconhecido", texto.strip())
+        else:
+            self.on_status(msg)
+
+    # ------- negociação de versão -------
+    def _use_version(self, version: int):
+        """Passa a falar `version` e reempacota o que está na janela."""
+        st = self.st
+        # send_lock antes: nenhum send() fica entre reserve() e put() com um
+        # pacote montado na versão antiga (mesma ordem de locks do send())
+        with st.send_lock, st.lock:
+            self.version = version
+            for seq, pkt in st.window.pending():
+                old = unpack_packet(pkt, self.key)
+                st.window.put(
+                    seq,
+                    pack_packet(
+                        version=version,
+                        flags=old["flags"],
+                        seq=old["seq"],
+                        ack=old["ack"],
+                        window_size=old["win"],
+                        payload=old["payload"],
+                    ),
+                )
+        self.on_status(f"[SISTEMA] Usando protocolo v{version} com o servidor.")
+
+    def _negotiate(self, pkt_version: int):
+        # Chamado só para respostas a DATA (ACK/DATA): o servidor responde na
+        # versão do último pacote válido nosso, então v2 aqui prova que ele fala v2.
+        self._heard_server = True
+        if self._fallback and pkt_version == self._preferred:
+            self._fallback = False
+            self._retry_interval = V2_RETRY_INTERVAL
+            if pkt_version > self.version:
+                self._use_version(pkt_version)
+        elif pkt_version < self.version and self.key is None:
+            # Servidor só fala versão menor: acompanha
+            self._use_version(pkt_version)
+
+    def _maybe_retry_version(self):
+        # v1 provisório: com a janela vazia, volta à versão preferida; se o
+        # servidor continuar mudo, o timeout cai para v1 de novo (backoff maior).
+        if not self._fallback or self.version >= self._preferred:
+            return
+        if time.monotonic() < self._retry_at:
+            return
+        with self.st.lock:
+            idle = self.st.window.empty()
+        if idle:
+            self._heard_server = False
+            self._use_version(self._preferred)
+
+    # ------- sessão esquecida pelo servidor -------
+    def _reset_session(self):
+        """
+        Servidor descartou a sessão (ociosa): recomeça do SEQ 1 com o login e
+        reenvia, renumerado, o que ainda não foi confirmado.
+        """
+        st = self.st
+        now = time.monotonic()
+        # Cada pacote da rajada antiga gera um RESET: só o primeiro vale
+        if self._login is None or now - self._reset_at < TIMEOUT:
+            return
+        self._reset_at = now
+        self.on_status("[SISTEMA] Servidor esqueceu a sessão. Refazendo login...")
+        with st.send_lock:
+            with st.lock:
+                payloads = [self._login] + [
+                    unpack_packet(pkt, self.key)["payload"]
+                    for _, pkt in st.window.pending()
+                ]
+                # login + janela cheia cabem: o anel arredonda para potência de 2
+                st.window = SendRing(WINDOW_SIZE + 1)
+                to_send = []
+                for payload in payloads:
+                    seq = st.window.reserve()
+                    pkt = pack_packet(
+                        version=self.version,
+                        flags=FLAG_DATA,
+                        seq=seq,
+                        ack=0,
+                        window_size=WINDOW_SIZE,
+                        payload=payload,
+                        key=self.key,
+                    )
+                    st.window.put(seq, pkt)
+                    to_send.append(pkt)
+                st.timer_start = now
+            for pkt in to_send:
+                try:
+                    self.sock.sendto(pkt, self.server_address)
+                except Exception as e:
+                    self.on_status(f"Erro ao enviar: {e}")
+
+    def _handle_packet(self, pkt: dict):
+        sock, st, serverAddress = self.sock, self.st, self.server_address
+        flags = pkt["flags"]
+
+        # Presença: não passa pela janela nem gera ACK. Também não negocia
+        # versão: vem na versão que o servidor viu por último, não em resposta.
+        if flags & FLAG_PRESENCE:
+            deltas = decode_deltas(pkt["payload"])
+            if deltas:
+                self.on_presence(deltas)
+            return
+
+        self._negotiate(pkt["version"])
+
+        if flags & FLAG_RESET:
+            self._reset_session()
+            return
+
+        # [TESTE] Descarte de Pacotes (Simulação)
+        if (flags & FLAG_DATA) and st.test_drop_packet:
+            self.on_status(
+                f"[TEST] Pacote SEQ={pkt['seq']} recebido mas DESCARTADO (Drop Packet)."
+            )
+            return
+
+        if flags & FLAG_DATA:
+            # [NOVO] CLIENTE AGORA RESPONDE COM ACK AO SERVIDOR
+            # Sem isso, o servidor não saberia que chegou e retransmitiria pra sempre.
+            ack_pkt = pack_packet(
+                version=self.version,
+                flags=FLAG_ACK,
+                seq=0,
+                ack=pkt["seq"],  # Confirma o SEQ recebido do server
+                window_size=WINDOW_SIZE,
+                payload=b"",
+                key=self.key,
+            )
+            sock.sendto(ack_pkt, serverAddress)
+
+            if pkt["payload"]:
+                msg = pkt["payload"].decode(errors="ignore").strip()
+                if msg:
+                    self._deliver(msg)
+
+        # Só pacotes com FLAG_ACK carregam ACK válido (seq 0 existe após wraparound)
+        if not (flags & FLAG_ACK):
+            return
+        acknum = pkt["ack"]
+
+        # [TESTE] Descarte de ACK (Simulação)
+        if not (flags & FLAG_DATA) and st.test_drop_ack:
+            self.on_status(f"[TEST] ACK={acknum} recebido mas IGNORADO (Drop ACK).")
+            return
 
-        # Checagem de Timeout (Retransmissão DO CLIENTE)
         with st.lock:
-            if (
+            st.peer_window = pkt.get("win", WINDOW_SIZE)
+            advanced = st.window.ack(acknum)
+            if advanced is not None:
+                if st.window.empty():
+                    st.timer_start = None
+                else:
+                    st.timer_start = time.monotonic()
+
+        if advanced:
+            self.on_ack(acknum)
+
+    def _check_timeout(self):
+        st = self.st
+        with st.lock:
+            expired = (
                 st.timer_start is not None
                 and (time.monotonic() - st.timer_start) >= TIMEOUT
-            ):
-                print(
-                    f"\n[SISTEMA] Timeout! Retransmitindo seq {st.base} até {st.nextSequenceNumber-1}..."
-                )
-                st.timer_start = time.monotonic()
-
-                count = 0
-                for resend_seq in range(st.base, st.nextSequenceNumber):
-                    if resend_seq in st.packages:
-                        try:
-                            packet_to_send = st.packages[resend_seq]
-                            sock.sendto(packet_to_send, serverAddress)
-                            count += 1
-                        except Exception as e:
-                            print(
-                                f"[ERRO] Falha na retransmissão seq={resend_seq}: {e}"
-                            )
-
-                if count == 0:
-                    st.timer_start = None
+            )
+        if not expired:
+            return
+
+        # Nenhuma resposta até agora: talvez o servidor não entenda v2.
+        # Provisório: _maybe_retry_version tenta a versão preferida mais tarde.
+        if not self._heard_server and self.version > PROTOCOL_V1 and self.key is None:
+            self._use_version(PROTOCOL_V1)
+            self._fallback = True
+            self._retry_at = time.monotonic() + self._retry_interval
+            self._retry_interval = min(self._retry_interval * 2, V2_RETRY_MAX)
 
+        with st.lock:
+            if st.timer_start is None or (time.monotonic() - st.timer_start) < TIMEOUT:
+                return
+            to_resend = st.window.pending()
+            st.timer_start = time.monotonic() if to_resend else None
 
+        if not to_resend:
+            return
+
+        # Retransmissão DO CLIENTE, já fora do lock
+        self.on_status(
+            f"[SISTEMA] Timeout! Retransmitindo seq {to_resend[0][0]} até {to_resend[-1][0]}..."
+        )
+        for resend_seq, packet_to_send in to_resend:
+            try:
+                self.sock.sendto(packet_to_send, self.server_address)
+            except Exception as e:
+                self.on_status(f"[ERRO] Falha na retransmissão seq={resend_seq}: {e}")
+
+    def _receiver_loop(self):
+        sock = self.sock
+        sock.settimeout(0.5)
+
+        while self._running:
+            try:
+                datagram, addr = sock.recvfrom(2048)
+            except timeout:
+                datagram = None
+            except OSError:
+                break
+            except Exception as e:
+                self.on_status(f"[ERRO DE DEBUG] Falha no recvfrom: {e}")
+                datagram = None
+
+            if datagram:
+                try:
+                    pkt = unpack_packet(datagram, self.key)
+                    if pkt["checksum_ok"]:
+                        self._handle_packet(pkt)
+                except Exception as e:
+                    self.on_status(f"[ERRO CRÍTICO] Falha ao processar pacote: {e}")
+                    import traceback  # só no caminho de erro
+
+                    traceback.print_exc()
+
+            self._check_timeout()
+            self._maybe_retry_version()
+
+            now = time.monotonic()
+            if now - self._last_heartbeat >= HEARTBEAT_INTERVAL:
+                self._last_heartbeat = now
+                # Heartbeat com estado: T1 enquanto digita, H (= não digitando)
+                self._send_presence(TYPING_ON if self._typing else HEARTBEAT)
+
+
+# ---------- CLI (wrapper fino sobre o ChatClient) ----------
 def main():
     try:
-        clientSocket = socket(AF_INET, SOCK_DGRAM)
-        serverAddress = (SERVER_NAME, SERVER_PORT)
-
-        st = State()
+        sys.stdout.reconfigure(encoding="utf-8")
+    except Exception:
+        pass
+
+    # Chave compartilhada opcional para sessões autenticadas
+    chat_key = os.environ.get("CHAT_KEY")
+    client = ChatClient(
+        on_message=lambda sender, text: print(f"\n{sender}|{text}"),
+        on_status=lambda text: print(f"\n{text}"),
+        key=chat_key.encode() if chat_key else None,
+    )
+    try:
         print("Digite mensagens (ou /quit pra sair):")
-
-        recv_thr = threading.Thread(
-            target=receiver_loop, args=(clientSocket, st, serverAddress), daemon=True
-        )
-        recv_thr.start()
+        client.start()
 
         while True:
             try:
@@ -170,7 +480,7 @@ def main():
             except Exception:
                 line = ""
 
-            if line is None:
+            if not line:
                 break
 
             msg = line.strip()
@@ -182,77 +492,23 @@ def main():
                 parts = msg.split()
                 cmd = parts[0]
                 val = len(parts) > 1 and parts[1] == "1"
-                with st.lock:
-                    if cmd == "///set_err":
-                        st.test_error = val
-                        print(f"[SISTEMA] Erro: {'ATIVADO' if val else 'DESATIVADO'}")
-                    elif cmd == "///set_drop_pkt":
-                        st.test_drop_packet = val
-                        print(
-                            f"[SISTEMA] Descarte de Pacotes: {'ATIVADO' if val else 'DESATIVADO'}"
-                        )
-                    elif cmd == "///set_drop_ack":
-                        st.test_drop_ack = val
-                        print(
-                            f"[SISTEMA] Descarte de ACKs: {'ATIVADO' if val else 'DESATIVADO'}"
-                        )
+                if cmd == "///set_err":
+                    client.set_test_error(val)
+                elif cmd == "///set_drop_pkt":
+                    client.set_drop_packet(val)
+                elif cmd == "///set_drop_ack":
+                    client.set_drop_ack(val)
                 continue
 
             if msg == "/quit":
                 break
 
-            payload = msg.encode()
-
-            with st.lock:
-                janela_efetiva = min(WINDOW_SIZE, st.peer_window)
-                if st.nextSequenceNumber >= st.base + janela_efetiva:
-                    print(f"Janela cheia. Aguarde ACKs.")
-                    continue
-
-                seq = st.nextSequenceNumber
-
-                # Pacote limpo para buffer
-                pkt_clean = pack_packet(
-                    version=1,
-                    flags=FLAG_DATA,
-                    seq=seq,
-                    ack=0,
-                    window_size=WINDOW_SIZE,
-                    payload=payload,
-                )
-                st.packages[seq] = pkt_clean
-
-                # Pacote para envio (pode ter erro)
-                pkt_to_send = pkt_clean
-                if st.test_error:
-                    print(f"[TEST] Gerando versão CORROMPIDA para SEQ={seq}...")
-                    pkt_to_send = pack_packet(
-                        version=1,
-                        flags=FLAG_DATA | FLAG_TEST_ERR,
-                        seq=seq,
-                        ack=0,
-                        window_size=WINDOW_SIZE,
-                        payload=payload,
-                    )
-
-                try:
-                    clientSocket.sendto(pkt_to_send, serverAddress)
-                except Exception as e:
-                    print(f"Erro ao enviar: {e}")
-                    continue
-
-                if st.base == st.nextSequenceNumber:
-                    st.timer_start = time.monotonic()
-
-                st.nextSequenceNumber += 1
+            client.send(msg)
 
     except KeyboardInterrupt:
         print("\nInterrompido.")
     finally:
-        try:
-            clientSocket.close()
-        except:
-            pass
+        client.close()
 
 
 if __name__ == "__main__":
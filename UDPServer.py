@@ -1,17 +1,176 @@
-from socket import *
-from protocol import unpack_packet, pack_packet, FLAG_DATA, FLAG_ACK
+from socket import socket, timeout, AF_INET, SOCK_DGRAM
+from protocol import (
+    unpack_packet,
+    pack_packet,
+    pack_header,
+    body_checksum,
+    seq_add,
+    FLAG_DATA,
+    FLAG_ACK,
+    FLAG_PRESENCE,
+    FLAG_RESET,
+    PROTOCOL_V1,
+    PROTOCOL_V2,
+    PROTOCOL_VERSION,
+)
+from ratelimit import RatePolicy, TokenBucket
+from presence import (
+    PresenceHub,
+    PRESENCE_FLUSH,
+    PRESENCE_TIMEOUT,
+    HEARTBEAT,
+    TYPING_ON,
+    TYPING_OFF,
+)
+from persistence import StateStore, NullStore, TABLES, SESSION_TTL, prune_idle
+from collections import deque
+import os
 import time
 
 SERVER_PORT = 12000
+# Diretório do snapshot/journal usado pela execução direta do script
+STATE_DIR = os.environ.get(
+    "CHAT_STATE_DIR", os.path.join(os.path.dirname(__file__), "server_state")
+)
 RECV_CAPACITY = 10
 TIMEOUT = 4.0  # Tempo para o servidor retransmitir
-
-
-def main():
+# Encaminhamento sem ACK há mais que isso (já retransmitido): destino não responde
+UNRESPONSIVE_AFTER = 2 * TIMEOUT
+
+
+def retransmit_due(serverSocket, forward_buffer, forward_bucket, now, policy):
+    """
+    Reenvia pacotes já enviados e vencidos de forward_buffer com pacing: no
+    máximo policy.retx_burst por destino a cada chamada, e só com ficha no
+    balde de encaminhamento do destino. O que sobrar continua vencido para a
+    próxima. Pacotes adiados (sent=False) saem só por drain_deferred, em ordem.
+    """
+    for dest_addr, buffer in forward_buffer.items():
+        bucket = forward_bucket.get(dest_addr)
+        budget = policy.retx_burst
+        for seq_num, item in buffer.items():
+            if budget == 0:
+                break
+            if not item["sent"] or now - item["time"] < TIMEOUT:
+                continue
+            if bucket is not None and not bucket.take(now):
+                break
+            print(
+                f"⏳ [SERVER] Timeout p/ {dest_addr} seq={seq_num}. Retransmitindo..."
+            )
+            try:
+                serverSocket.sendto(item["pkt"], dest_addr)
+                item["time"] = now  # Reinicia timer
+                item["sent"] = True
+            except Exception as e:
+                print(f"Erro retransmissão server: {e}")
+            budget -= 1
+
+
+def drain_deferred(serverSocket, forward_buffer, deferred, forward_bucket, now):
+    """
+    Envia os encaminhamentos adiados na ordem de chegada (FIFO por destino),
+    um por ficha do balde do destino: a vazão segue policy.forward_rate.
+    Filas esvaziadas saem de `deferred`.
+    """
+    for dest_addr in list(deferred):
+        fifo = deferred[dest_addr]
+        buffer = forward_buffer.get(dest_addr, {})
+        bucket = forward_bucket.get(dest_addr)
+        while fifo:
+            item = buffer.get(fifo[0])
+            if item is None:  # já confirmado ou sessão descartada
+                fifo.popleft()
+                continue
+            if bucket is not None and not bucket.take(now):
+                break
+            seq_num = fifo.popleft()
+            print(f"📤 Encaminhamento adiado enviado p/ {dest_addr} seq={seq_num}")
+            try:
+                serverSocket.sendto(item["pkt"], dest_addr)
+            except Exception as e:
+                print(f"Erro encaminhamento adiado: {e}")
+            item["time"] = item["first"] = now
+            item["sent"] = True
+        if not fifo:
+            del deferred[dest_addr]
+
+
+def pick_target(sender, clients, forward_buffer, peer_version, key, now):
+    """
+    Escolhe o destino de um encaminhamento (ou None).
+    1º: quem mandou qualquer pacote há até PRESENCE_TIMEOUT (heartbeat, DATA
+        ou ACK de encaminhamento).
+    2º: quem está quieto mas não deve nada: clientes v1 antigos não mandam
+        heartbeat e continuam destino enquanto confirmarem o que recebem.
+    Fica de fora quem tem encaminhamento sem ACK há mais de UNRESPONSIVE_AFTER
+    (p.ex. sessão recuperada de um cliente que morreu) e, com `key`, quem não
+    fala v2.
+    """
+    fallback = None
+    for c, last_seen in clients.items():
+        if c == sender:
+            continue
+        if key is not None and peer_version.get(c, PROTOCOL_V1) < PROTOCOL_V2:
+            continue
+        oldest = next(iter(forward_buffer.get(c, {}).values()), None)
+        if oldest and oldest["sent"] and now - oldest["first"] > UNRESPONSIVE_AFTER:
+            continue
+        if now - last_seen <= PRESENCE_TIMEOUT:
+            return c
+        if fallback is None:
+            fallback = c
+    return fallback
+
+
+def send_presence(serverSocket, members, chunks, peer_version, key):
+    """
+    Envia payloads de presença (sem SEQ, sem ACK) para os membros.
+    O pacote só depende da versão do destino, então é montado uma vez por versão.
+    """
+    for payload in chunks:
+        by_version = {}
+        for addr in members:
+            ver = peer_version.get(addr, PROTOCOL_V1)
+            pkt = by_version.get(ver)
+            if pkt is None:
+                pkt = by_version[ver] = pack_packet(
+                    version=ver,
+                    flags=FLAG_PRESENCE,
+                    seq=0,
+                    ack=0,
+                    window_size=0,
+                    payload=payload,
+                    key=key if ver >= PROTOCOL_V2 else None,
+                )
+            try:
+                serverSocket.sendto(pkt, addr)
+            except Exception as e:
+                print(f"Erro enviando presença p/ {addr}: {e}")
+
+
+def main(
+    port: int = SERVER_PORT,
+    policy: RatePolicy | None = None,
+    key: bytes | None = None,
+    state_dir: str | None = None,
+):
+    """
+    Laço do servidor. Com `key`, só aceita pacotes v2 autenticados (MAC).
+    Com `state_dir`, as sessões são recuperadas na partida e persistidas
+    (journal + snapshots, ver persistence.py).
+    """
+    policy = policy or RatePolicy()
+    store = StateStore(state_dir) if state_dir else NullStore()
     serverSocket = socket(AF_INET, SOCK_DGRAM)
-    serverSocket.bind(("", SERVER_PORT))
-    serverSocket.settimeout(0.5)  # Necessário para checar retransmissão periodicamente
-    print(f"Server pronto em {SERVER_PORT} \n")
+    serverSocket.bind(("", port))
+    # Necessário para checar retransmissão e enviar presença periodicamente;
+    # com encaminhamentos adiados o laço acorda no ritmo de uma ficha.
+    idle_timeout = min(policy.retx_interval, PRESENCE_FLUSH)
+    drain_timeout = min(idle_timeout, max(1.0 / policy.forward_rate, 0.005))
+    cur_timeout = idle_timeout
+    serverSocket.settimeout(cur_timeout)
+    print(f"Server pronto em {port} \n")
 
     # ── Tabelas de estado ───────────────────────────────────────────────
     clients = {}  # (ip, porta): timestamp do último pacote
@@ -19,60 +178,204 @@ def main():
     lastAck = {}  # Último ACK enviado AO cliente
     recvBufferUsage = {}  # Controle de fluxo
     usernames = {}  # Nome do usuário
+    name_prefix = {}  # b"nome|" já codificado, prefixo das mensagens encaminhadas
+    peer_version = {}  # Versão do protocolo falada com o cliente
 
     # [NOVO] Estruturas para retransmissão do Servidor -> Cliente
     # { (ip, porta): { seq: {'pkt': bytes, 'time': float} } }
     forward_buffer = {}
+    # { (ip, porta): deque[seq] } -> adiados sem ficha, em ordem (só execução)
+    deferred = {}
     # { (ip, porta): int } -> Próximo SEQ a enviar PARA o cliente
     server_seq_out = {}
 
+    # Tabelas que vão para o snapshot (mesmos objetos, atualizados in-place)
+    tables = {
+        "clients": clients,
+        "expectedNumberSequence": expectedNumberSequence,
+        "lastAck": lastAck,
+        "usernames": usernames,
+        "peer_version": peer_version,
+        "forward_buffer": forward_buffer,
+        "server_seq_out": server_seq_out,
+    }
+
+    # Limites de taxa por sessão (ver ratelimit.RatePolicy)
+    inbound_bucket = {}  # DATA vindos do cliente
+    forward_bucket = {}  # DATA encaminhados/retransmitidos ao cliente
+    dupack_bucket = {}  # DUP-ACKs ao cliente (evita amplificação)
+    ack_bucket = {}  # ACKs puros vindos do cliente
+    last_retx_check = 0.0
+
+    def open_session(addr, now):
+        # Estado só de execução (não vai para o snapshot)
+        recvBufferUsage[addr] = 0
+        inbound_bucket[addr] = TokenBucket(
+            policy.inbound_rate, policy.inbound_burst, now
+        )
+        forward_bucket[addr] = TokenBucket(
+            policy.forward_rate, policy.forward_burst, now
+        )
+        dupack_bucket[addr] = TokenBucket(policy.dupack_rate, policy.dupack_burst, now)
+        ack_bucket[addr] = TokenBucket(policy.ack_rate, policy.ack_burst, now)
+
+    def close_session(addr):
+        # Contraparte de open_session; as tabelas persistidas já saíram em prune_idle
+        for table in (
+            recvBufferUsage,
+            name_prefix,
+            deferred,
+            inbound_bucket,
+            forward_bucket,
+            dupack_bucket,
+            ack_bucket,
+        ):
+            table.pop(addr, None)
+        presence.leave(addr)
+
+    t0 = time.perf_counter()
+    restored = store.load()
+    if restored:
+        for name in TABLES:
+            tables[name].update(restored[name])
+        for addr, name in usernames.items():
+            name_prefix[addr] = name.encode() + b"|"
+        # O tempo parado não conta para o SESSION_TTL, mas ninguém recuperado
+        # é tido como vivo: fica no 2º nível de pick_target até mandar algo,
+        # e clientes que já falaram com esta execução têm preferência.
+        # Encaminhamentos recuperados contam como enviados há muito tempo: o
+        # destino que não confirmar o reenvio sai de pick_target.
+        now = time.time()
+        downtime = max(now - max(clients.values(), default=now), 0.0)
+        for addr in clients:
+            clients[addr] = min(clients[addr] + downtime, now - PRESENCE_TIMEOUT)
+            open_session(addr, now)
+        print(
+            f"♻️  Estado recuperado: {len(clients)} clientes em "
+            f"{(time.perf_counter() - t0) * 1000:.1f} ms\n"
+        )
+
+    # Presença: roster por sala + deltas coalescidos (ver presence.py)
+    presence = PresenceHub()
+    last_presence_flush = 0.0
+
     try:
         while True:
+            # [NOVO] Verifica timeouts de retransmissão do servidor
+            # (também sob carga, não só quando o recvfrom fica ocioso)
+            now = time.time()
+            if now - last_retx_check >= policy.retx_interval:
+                last_retx_check = now
+                retransmit_due(
+                    serverSocket, forward_buffer, forward_bucket, now, policy
+                )
+                # Sessões ociosas (inclusive o forward_buffer) não vão para o
+                # snapshot nem seguem recebendo encaminhamentos
+                for addr in prune_idle(tables, now, SESSION_TTL):
+                    close_session(addr)
+                    store.log("D", addr)
+                    print(f"🧹 Sessão ociosa descartada: {addr}")
+                store.commit()
+                store.maybe_snapshot(tables, now)
+            if deferred:
+                drain_deferred(
+                    serverSocket, forward_buffer, deferred, forward_bucket, now
+                )
+            want = drain_timeout if deferred else idle_timeout
+            if want != cur_timeout:
+                cur_timeout = want
+                serverSocket.settimeout(cur_timeout)
+            if now - last_presence_flush >= PRESENCE_FLUSH:
+                last_presence_flush = now
+                presence.expire(clients, now)
+                for members, chunks in presence.flush():
+                    send_presence(serverSocket, members, chunks, peer_version, key)
+
             try:
                 datagram, clientAddress = serverSocket.recvfrom(2048)
             except timeout:
-                # [NOVO] Verifica timeouts de retransmissão do servidor
-                now = time.time()
-                for dest_addr, buffer in forward_buffer.items():
-                    for seq_num, item in list(buffer.items()):
-                        if now - item["time"] >= TIMEOUT:
-                            print(
-                                f"⏳ [SERVER] Timeout p/ {dest_addr} seq={seq_num}. Retransmitindo..."
-                            )
-                            try:
-                                serverSocket.sendto(item["pkt"], dest_addr)
-                                item["time"] = now  # Reinicia timer
-                            except Exception as e:
-                                print(f"Erro retransmissão server: {e}")
                 continue
             except Exception as e:
                 print("Erro ao receber pacote:", e)
                 continue
 
+            # Servidor com chave só conversa em v2 autenticado: v1 nem vira
+            # sessão (senão receberia encaminhamentos em claro sem nunca autenticar)
+            if key is not None and (not datagram or datagram[0] < PROTOCOL_V2):
+                continue
+
             # registra cliente
+            now = time.time()
             first_time = clientAddress not in clients
-            clients[clientAddress] = time.time()
+            clients[clientAddress] = now
+            store.touch(clientAddress, now)
 
             if first_time:
                 expectedNumberSequence[clientAddress] = 1
                 lastAck[clientAddress] = 0
-                recvBufferUsage[clientAddress] = 0
                 forward_buffer[clientAddress] = {}
                 server_seq_out[clientAddress] = 1
+                open_session(clientAddress, now)
+                # Primeira estimativa da versão; confirmada pelos pacotes válidos
+                peer_version[clientAddress] = (
+                    min(max(datagram[0], PROTOCOL_V1), PROTOCOL_VERSION)
+                    if datagram
+                    else PROTOCOL_V1
+                )
+                store.log("N", clientAddress, now)
+                store.log("V", clientAddress, peer_version[clientAddress])
                 print(f"[NOVO CLIENTE] {clientAddress} (total={len(clients)})")
                 print(f"Clientes atuais: {list(clients.keys())}\n")
 
+            # Acima da taxa: descarta em silêncio (sem DUP-ACK); o cliente
+            # retransmite quando o timer dele estourar. O byte de flags é
+            # lido antes do unpack para não gastar checksum com pacote que
+            # vai ser descartado. ACKs puros têm um balde próprio e folgado,
+            # para não disputarem com DATA nem virarem passe livre.
+            is_pure_ack = (
+                len(datagram) > 1
+                and datagram[1] & FLAG_ACK
+                and not datagram[1] & FLAG_DATA
+            )
+            bucket = ack_bucket if is_pure_ack else inbound_bucket
+            if not bucket[clientAddress].take(now):
+                continue
+
             # tenta desempacotar
             try:
-                packageClient = unpack_packet(datagram)
+                packageClient = unpack_packet(datagram, key)
             except Exception as e:
                 print(f"[{clientAddress}] pacote inválido: {e}")
                 continue
 
+            # Negociação: responde na versão do último pacote válido do peer
+            if packageClient["checksum_ok"]:
+                negotiated = min(packageClient["version"], PROTOCOL_VERSION)
+                if peer_version[clientAddress] != negotiated:
+                    peer_version[clientAddress] = negotiated
+                    store.log("V", clientAddress, negotiated)
+            ver = peer_version[clientAddress]
+            ver_key = key if ver >= PROTOCOL_V2 else None
+
             sequenceNumber = packageClient["seq"]
             checksumOk = packageClient["checksum_ok"]
             flags = packageClient["flags"]
 
+            # Presença (heartbeat / digitando): sem ACK e sem DUP-ACK.
+            # O heartbeat em si só atualiza clients[addr] (feito acima).
+            if flags & FLAG_PRESENCE:
+                if checksumOk and clientAddress in usernames:
+                    if clientAddress not in presence.room_of:
+                        presence.join(clientAddress, usernames[clientAddress])
+                    body = packageClient["payload"]
+                    # Todo pacote de presença diz o estado de digitação:
+                    # H vale como T0, então um T0 perdido não trava o "digitando"
+                    if body == TYPING_ON:
+                        presence.typing(clientAddress, True)
+                    elif body == TYPING_OFF or body == HEARTBEAT:
+                        presence.typing(clientAddress, False)
+                continue
+
             # [NOVO] Tratamento de ACKs puros vindos do Cliente (Confirmação de msg encaminhada)
             # Se for apenas ACK (sem dados), removemos do buffer de retransmissão
             if checksumOk and (flags & FLAG_ACK) and not (flags & FLAG_DATA):
@@ -82,6 +385,7 @@ def main():
                     and ack_rec in forward_buffer[clientAddress]
                 ):
                     del forward_buffer[clientAddress][ack_rec]
+                    store.log("A", clientAddress, ack_rec)
                     print(
                         f"✅ [SERVER] ACK {ack_rec} recebido de {clientAddress}. Retirado do buffer."
                     )
@@ -101,101 +405,171 @@ def main():
             # ── Pacote correto e em ordem ─────────────────────────────
             if checksumOk and (flags & FLAG_DATA) and sequenceNumber == expectedNumber:
                 try:
-                    raw_text = packageClient["payload"].decode(errors="ignore")
-
-                    # Login / Username
+                    # Login / Username (único ponto em que o payload é decodificado)
                     if clientAddress not in usernames:
+                        raw_text = packageClient["payload"].decode(errors="ignore")
                         usernames[clientAddress] = (
                             raw_text.strip() or f"{clientAddress[0]}:{clientAddress[1]}"
                         )
+                        name_prefix[clientAddress] = (
+                            usernames[clientAddress].encode() + b"|"
+                        )
                         lastAck[clientAddress] = sequenceNumber
-                        expectedNumberSequence[clientAddress] = expectedNumber + 1
+                        expectedNumberSequence[clientAddress] = seq_add(expectedNumber)
+                        store.log("L", clientAddress, usernames[clientAddress])
+                        store.log(
+                            "R",
+                            clientAddress,
+                            expectedNumberSequence[clientAddress],
+                            lastAck[clientAddress],
+                        )
+                        store.commit()  # write-ahead: journal antes do ACK
 
                         # ACK do login
                         ack_only = pack_packet(
-                            version=1,
+                            version=ver,
                             flags=FLAG_ACK,
                             seq=0,
                             ack=lastAck[clientAddress],
                             window_size=free,
                             payload=b"",
+                            key=ver_key,
                         )
                         serverSocket.sendto(ack_only, clientAddress)
                         print(f"👤 Username registrado: {usernames[clientAddress]}")
+
+                        # Entra na sala: no próximo flush ele recebe o roster
+                        # e os outros recebem o "+nome"
+                        presence.join(clientAddress, usernames[clientAddress])
                         continue
 
                     # Mensagem normal (Encaminhamento)
-                    # a partir daqui são mensagens normais
-                    sender_name = usernames.get(
-                        clientAddress, f"{clientAddress[0]}:{clientAddress[1]}"
+                    # a partir daqui são mensagens normais, sempre em bytes:
+                    # corpo = prefixo "nome|" (cacheado) + payload recebido.
+                    # Usar '|' como separador para o cliente entender.
+                    body = name_prefix[clientAddress] + packageClient["payload"]
+                    body_sums = {}  # versão → checksum do corpo, reaproveitado
+
+                    # Escolhe destinatário antes de aceitar: se a fila dele
+                    # estiver cheia, recusa sem ACK (o remetente retransmite
+                    # depois) em vez de deixar o forward_buffer crescer sem teto.
+                    other = pick_target(
+                        clientAddress, clients, forward_buffer, peer_version, key, now
                     )
-
-                    # CORREÇÃO: Usar '|' como separador para a GUI do cliente entender
-                    # Antes era: forwarded_text = f"{sender_name} > {raw_text}"
-                    forwarded_text = f"{sender_name}|{raw_text}"
-
-                    data_to_send = forwarded_text.encode()
+                    if (
+                        other
+                        and len(forward_buffer.get(other, ())) >= policy.forward_queue
+                    ):
+                        print(
+                            f"🚫 Fila de {other} cheia; DATA de {clientAddress} recusado"
+                        )
+                        continue
 
                     recvBufferUsage[clientAddress] = min(RECV_CAPACITY, used + 1)
 
                     # Atualiza estado (Recebimento)
                     lastAck[clientAddress] = sequenceNumber
-                    expectedNumberSequence[clientAddress] = expectedNumber + 1
-
-                    # Envia ACK para o REMETENTE (Confirmando que o server recebeu)
-                    ack_pkt = pack_packet(
-                        version=1,
-                        flags=FLAG_ACK,
-                        seq=0,
-                        ack=lastAck[clientAddress],
-                        window_size=free,
-                        payload=b"",
+                    expectedNumberSequence[clientAddress] = seq_add(expectedNumber)
+                    store.log(
+                        "R",
+                        clientAddress,
+                        expectedNumberSequence[clientAddress],
+                        lastAck[clientAddress],
                     )
-                    serverSocket.sendto(ack_pkt, clientAddress)
-                    print(f"⏩ ACK enviado ao remetente {clientAddress}")
 
-                    # Escolhe destinatário e ENCAMINHA
-                    other = next(
-                        (c for c in clients.keys() if c != clientAddress), None
-                    )
+                    # ENCAMINHA
                     if other:
                         # [NOVO] Lógica de envio confiável para o DESTINATÁRIO
                         seq_out = server_seq_out.get(other, 1)
 
-                        fwd_pkt = pack_packet(
-                            version=1,
-                            flags=FLAG_DATA,
-                            seq=seq_out,  # Usa sequencial real
-                            ack=0,
-                            window_size=free,
-                            payload=data_to_send,
-                        )
+                        # Só o header é por destinatário (MAC cobre o pacote todo)
+                        other_ver = peer_version.get(other, PROTOCOL_V1)
+                        if key is not None and other_ver >= PROTOCOL_V2:
+                            fwd_pkt = pack_packet(
+                                version=other_ver,
+                                flags=FLAG_DATA,
+                                seq=seq_out,  # Usa sequencial real
+                                ack=0,
+                                window_size=free,
+                                payload=body,
+                                key=key,
+                            )
+                        else:
+                            if other_ver not in body_sums:
+                                body_sums[other_ver] = body_checksum(body, other_ver)
+                            fwd_pkt = (
+                                pack_header(
+                                    version=other_ver,
+                                    flags=FLAG_DATA,
+                                    seq=seq_out,  # Usa sequencial real
+                                    ack=0,
+                                    window_size=free,
+                                    length=len(body),
+                                    body_sum=body_sums[other_ver],
+                                )
+                                + body
+                            )
 
-                        # Guarda no buffer para retransmitir se necessário
+                        # Guarda no buffer para retransmitir se necessário.
+                        # Só sai na hora se não houver adiados para o destino
+                        # (senão furaria a fila) e houver ficha; caso contrário
+                        # entra no fim da FIFO e sai por drain_deferred.
                         if other not in forward_buffer:
                             forward_buffer[other] = {}
+                        send_now = other not in deferred and forward_bucket[other].take(
+                            now
+                        )
                         forward_buffer[other][seq_out] = {
                             "pkt": fwd_pkt,
-                            "time": time.time(),
+                            "time": now,
+                            "first": now,  # 1º envio (drain_deferred atualiza)
+                            "sent": send_now,
                         }
-                        server_seq_out[other] = seq_out + 1
-
-                        serverSocket.sendto(fwd_pkt, other)
-                        print(f"📤 Mensagem encaminhada para {other} (seq={seq_out})")
+                        if not send_now:
+                            deferred.setdefault(other, deque()).append(seq_out)
+                        server_seq_out[other] = seq_add(seq_out)
+                        store.log("F", other, seq_out, fwd_pkt)
+                        store.commit()  # write-ahead: journal antes de enviar
+
+                        if send_now:
+                            serverSocket.sendto(fwd_pkt, other)
+                            print(
+                                f"📤 Mensagem encaminhada para {other} (seq={seq_out})"
+                            )
+                        else:
+                            print(
+                                f"⏸️  Encaminhamento p/ {other} adiado (seq={seq_out})"
+                            )
                     else:
                         # Nenhum destinatário (não precisa salvar no buffer pois é aviso do sistema)
                         info = "Nenhum outro cliente conectado ainda."
                         info_pkt = pack_packet(
-                            version=1,
+                            version=ver,
                             flags=FLAG_DATA | FLAG_ACK,
                             seq=0,
                             ack=lastAck[clientAddress],
                             window_size=free,
                             payload=f"[servidor] {info}".encode(),
+                            key=ver_key,
                         )
+                        store.commit()
                         serverSocket.sendto(info_pkt, clientAddress)
                         print("ℹ️  Nenhum destinatario disponivel.")
 
+                    # Envia ACK para o REMETENTE (Confirmando que o server recebeu)
+                    # Depois do encaminhamento já registrado no journal
+                    ack_pkt = pack_packet(
+                        version=ver,
+                        flags=FLAG_ACK,
+                        seq=0,
+                        ack=lastAck[clientAddress],
+                        window_size=free,
+                        payload=b"",
+                        key=ver_key,
+                    )
+                    serverSocket.sendto(ack_pkt, clientAddress)
+                    print(f"⏩ ACK enviado ao remetente {clientAddress}")
+
                     if recvBufferUsage[clientAddress] > 0:
                         recvBufferUsage[clientAddress] -= 1
 
@@ -205,14 +579,33 @@ def main():
 
             # ── Pacote duplicado ou erro ────────────────
             else:
+                if not dupack_bucket[clientAddress].take(now):
+                    continue  # teto de DUP-ACKs por cliente
+                # DATA válido fora do login numa sessão sem nome: o servidor
+                # esqueceu o cliente (sessão ociosa descartada). DUP-ACK 0 não
+                # anda a janela dele; pede para refazer o login com SEQ 1.
+                if checksumOk and flags & FLAG_DATA and clientAddress not in usernames:
+                    reset_pkt = pack_packet(
+                        version=ver,
+                        flags=FLAG_RESET,
+                        seq=0,
+                        ack=0,
+                        window_size=free,
+                        payload=b"",
+                        key=ver_key,
+                    )
+                    serverSocket.sendto(reset_pkt, clientAddress)
+                    print(f"🔄 Sessão desconhecida; RESET para {clientAddress}")
+                    continue
                 dupAckNumber = lastAck.get(clientAddress, 0)
                 packageServer = pack_packet(
-                    version=1,
+                    version=ver,
                     flags=FLAG_ACK,
                     seq=0,
                     ack=dupAckNumber,
                     window_size=free,
                     payload=b"",
+                    key=ver_key,
                 )
                 serverSocket.sendto(packageServer, clientAddress)
                 print(f"↩️  DUP-ACK reenviado ({dupAckNumber})")
@@ -220,8 +613,11 @@ def main():
     except KeyboardInterrupt:
         print("\n🛑 Interrompido pelo usuário.")
     finally:
+        store.close()
         serverSocket.close()
 
 
 if __name__ == "__main__":
-    main()
+    # Chave compartilhada opcional para sessões autenticadas
+    chat_key = os.environ.get("CHAT_KEY")
+    main(key=chat_key.encode() if chat_key else None, state_dir=STATE_DIR)
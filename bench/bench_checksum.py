@@ -0,0 +1,68 @@
+# bench/bench_checksum.py
+# Custo de validação por pacote (unpack_packet) para cada opção de integridade:
+# v1 (soma 16-bit, loop original em Python puro e versão atual com array),
+# v2 com CRC32 e v2 com CRC32 + HMAC truncado.
+#
+#   python bench/bench_checksum.py --sizes 64 512 1400
+
+import argparse
+import os
+import struct
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import protocol
+from protocol import pack_packet, unpack_packet, FLAG_DATA, PROTOCOL_V1, PROTOCOL_V2
+
+KEY = b"chave-de-teste"
+
+
+def _loop_checksum(data: bytes) -> int:
+    # Implementação original (palavra a palavra), para referência
+    if len(data) & 1:
+        data += b"\x00"
+    s = 0
+    for i in range(0, len(data), 2):
+        w = (data[i] << 8) | data[i + 1]
+        s = (s + w) & 0xFFFF
+    return (~s) & 0xFFFF
+
+
+def unpack_v1_loop(datagram: bytes) -> bool:
+    fields = struct.unpack(">BBIIHHH", datagram[: protocol.HEADER_SIZE])
+    header_no_csum = struct.pack(">BBIIHH", *fields[:6])
+    return (
+        _loop_checksum(header_no_csum + datagram[protocol.HEADER_SIZE :]) == fields[6]
+    )
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", type=int, nargs="+", default=[64, 512, 1400])
+    ap.add_argument("--number", type=int, default=20000)
+    args = ap.parse_args()
+
+    print(f"{'payload':>8} {'opção':<22} {'µs/pacote':>10}")
+    for size in args.sizes:
+        payload = os.urandom(size)
+        common = dict(flags=FLAG_DATA, seq=1, ack=0, payload=payload)
+        v1 = pack_packet(version=PROTOCOL_V1, **common)
+        v2 = pack_packet(version=PROTOCOL_V2, **common)
+        v2_mac = pack_packet(version=PROTOCOL_V2, key=KEY, **common)
+
+        cases = [
+            ("v1 soma16 (loop)", lambda: unpack_v1_loop(v1)),
+            ("v1 soma16 (array)", lambda: unpack_packet(v1)["checksum_ok"]),
+            ("v2 crc32", lambda: unpack_packet(v2)["checksum_ok"]),
+            ("v2 crc32 + hmac", lambda: unpack_packet(v2_mac, KEY)["checksum_ok"]),
+        ]
+        for name, fn in cases:
+            assert fn()
+            t = timeit.timeit(fn, number=args.number)
+            print(f"{size:>8} {name:<22} {t / args.number * 1e6:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+# bench/bench_client_contention.py
+# Mede a disputa pelos locks do ChatClient com envio em alta taxa.
+# Um "servidor" local faz Go-Back-N como o UDPServer: só aceita o SEQ
+# esperado e confirma com ACK cumulativo; fora de ordem vira DUP-ACK do último
+# SEQ em ordem. Enquanto isso, N threads chamam client.send() sem parar.
+#
+#   python bench/bench_client_contention.py --threads 4 --seconds 3 --window 64
+
+import argparse
+import os
+import sys
+import threading
+import time
+from socket import socket, AF_INET, SOCK_DGRAM, timeout
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import UDPClient
+from protocol import unpack_packet, pack_packet, seq_add, FLAG_ACK, FLAG_DATA
+
+
+class TimedLock:
+    """threading.Lock que acumula o tempo de espera na aquisição."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.acquisitions = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def __enter__(self):
+        t0 = time.perf_counter()
+        self._lock.acquire()
+        waited = time.perf_counter() - t0
+        self.acquisitions += 1
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+        return self
+
+    def __exit__(self, *exc):
+        self._lock.release()
+
+
+def ack_server(sock, window, stop, stats):
+    sock.settimeout(0.2)
+    expected = 1
+    while not stop.is_set():
+        try:
+            datagram, addr = sock.recvfrom(2048)
+        except timeout:
+            continue
+        except OSError:
+            break
+        pkt = unpack_packet(datagram)
+        if not pkt["checksum_ok"] or not pkt["flags"] & FLAG_DATA:
+            continue
+        if pkt["seq"] == expected:
+            expected = seq_add(expected, 1)
+        else:
+            stats["out_of_order"] += 1
+        ack = pack_packet(
+            version=1,
+            flags=FLAG_ACK,
+            seq=0,
+            ack=seq_add(expected, -1),
+            window_size=window,
+            payload=b"",
+        )
+        sock.sendto(ack, addr)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--threads", type=int, default=4)
+    ap.add_argument("--seconds", type=float, default=3.0)
+    ap.add_argument("--window", type=int, default=64)
+    args = ap.parse_args()
+
+    UDPClient.WINDOW_SIZE = args.window
+
+    srv = socket(AF_INET, SOCK_DGRAM)
+    srv.bind(("127.0.0.1", 0))
+    stop = threading.Event()
+    stats = {"out_of_order": 0}
+    threading.Thread(
+        target=ack_server, args=(srv, args.window, stop, stats), daemon=True
+    ).start()
+
+    client = UDPClient.ChatClient(server_address=srv.getsockname())
+    client.st.lock = lock = TimedLock()
+    client.st.send_lock = send_lock = TimedLock()
+    client.st.peer_window = args.window
+    client.start()
+
+    sent = [0] * args.threads
+    full = [0] * args.threads
+
+    def sender(i):
+        end = time.perf_counter() + args.seconds
+        while time.perf_counter() < end:
+            if client.send(f"msg {i}"):
+                sent[i] += 1
+            else:
+                full[i] += 1
+                time.sleep(0)
+
+    workers = [threading.Thread(target=sender, args=(i,)) for i in range(args.threads)]
+    t0 = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - t0
+
+    stop.set()
+    client.close()
+    srv.close()
+
+    total = sum(sent)
+    print(f"threads={args.threads} window={args.window} tempo={elapsed:.2f}s")
+    print(f"enviadas={total} ({total / elapsed:,.0f} msg/s)  janela cheia={sum(full)}")
+    print(f"fora de ordem no servidor={stats['out_of_order']}")
+    for name, lk in (("lock da janela", lock), ("lock de envio", send_lock)):
+        print(
+            f"{name}: aquisições={lk.acquisitions} "
+            f"espera média={lk.wait_total / max(lk.acquisitions, 1) * 1e6:.1f}µs "
+            f"espera máx={lk.wait_max * 1e3:.2f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
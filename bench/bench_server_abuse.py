@@ -0,0 +1,160 @@
+# bench/bench_server_abuse.py
+# Teste de carga: latência de clientes bem-comportados com um cliente abusivo.
+# Sobe o UDPServer num subprocesso; alice manda um ping a cada 50 ms para bob
+# e medimos envio → on_message; ping recusado (janela cheia) ou não entregue
+# conta como falha nos percentis. Na segunda fase, outro processo inunda o
+# servidor com DATA em ordem, pacotes corrompidos (que pediriam DUP-ACK) e ACKs
+# falsos com corpo grande, a --rate pacotes/s (padrão 6000, >100x o
+# inbound_rate): é o abuso que o limite por cliente deve absorver. Uma
+# inundação sem ritmo enche o buffer de recepção do kernel antes de o servidor
+# ler qualquer pacote, e aí nenhum limite em espaço de usuário ajuda.
+#
+#   python bench/bench_server_abuse.py --seconds 3 --rate 6000
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+from socket import socket, AF_INET, SOCK_DGRAM
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from UDPClient import ChatClient
+from protocol import pack_packet, seq_add, FLAG_DATA, FLAG_ACK, FLAG_TEST_ERR
+
+
+def abuser(port, seconds, rate):
+    sock = socket(AF_INET, SOCK_DGRAM)
+    addr = ("127.0.0.1", port)
+    seq = 1
+    start = time.perf_counter()
+    end = start + seconds
+    sent = 0
+    while time.perf_counter() < end:
+        # Ritmo fixo: `rate` pacotes/s no total (3 por volta)
+        ahead = start + sent / rate - time.perf_counter()
+        if ahead > 0:
+            time.sleep(ahead)
+        payload = b"mallory" if seq == 1 else b"spam" * 8
+        sock.sendto(
+            pack_packet(version=1, flags=FLAG_DATA, seq=seq, ack=0, payload=payload),
+            addr,
+        )
+        sock.sendto(
+            pack_packet(
+                version=1, flags=FLAG_DATA | FLAG_TEST_ERR, seq=seq, ack=0, payload=b"x"
+            ),
+            addr,
+        )
+        # ACK falso com corpo grande: custa unpack + checksum se escapar do limite
+        sock.sendto(
+            pack_packet(version=1, flags=FLAG_ACK, seq=0, ack=seq, payload=b"a" * 1200),
+            addr,
+        )
+        seq = seq_add(seq)
+        sent += 3
+    print(f"abusador enviou {sent} pacotes ({sent / seconds:,.0f}/s)")
+
+
+def run_phase(alice, lat, seconds, interval=0.05):
+    """Manda um ping a cada `interval`; retorna (tentativas, recusados, latências)."""
+    lat.clear()
+    attempts = refused = 0
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        attempts += 1
+        if not alice.send(f"ping {time.perf_counter():.9f}"):
+            refused += 1  # janela cheia: conta como falha, não some da amostra
+        time.sleep(interval)
+    time.sleep(0.5)
+    return attempts, refused, list(lat)
+
+
+def report(name, attempts, refused, sample):
+    # Percentis sobre TODAS as tentativas: recusado ou não entregue conta como
+    # latência infinita, senão perder pings faria a fase parecer mais rápida.
+    lost = attempts - len(sample)
+    padded = sorted(x * 1000 for x in sample) + [float("inf")] * lost
+
+    def fmt(ms):
+        return "perdido" if ms == float("inf") else f"{ms:.2f}ms"
+
+    p50 = padded[len(padded) // 2] if padded else float("inf")
+    p95 = padded[max(int(len(padded) * 0.95) - 1, 0)] if padded else float("inf")
+    worst = max(sample) * 1000 if sample else float("inf")
+    print(
+        f"{name}: entregues={len(sample)}/{attempts} recusados={refused} "
+        f"falhas={lost} p50={fmt(p50)} p95={fmt(p95)} máx entregue={fmt(worst)}"
+    )
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--seconds", type=float, default=3.0)
+    ap.add_argument("--port", type=int, default=12555)
+    ap.add_argument("--rate", type=float, default=6000, help="pacotes/s do abusador")
+    ap.add_argument("--abuser", action="store_true", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.abuser:
+        abuser(args.port, args.seconds, args.rate)
+        return
+
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-c",
+            f"import sys; sys.path.insert(0, {ROOT!r}); "
+            f"import UDPServer; UDPServer.main(port={args.port})",
+        ],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    time.sleep(0.5)
+
+    lat = []
+
+    def on_message(_sender, text):
+        if text.startswith("ping "):
+            lat.append(time.perf_counter() - float(text[5:]))
+
+    server_addr = ("127.0.0.1", args.port)
+    alice = ChatClient(server_address=server_addr)
+    bob = ChatClient(server_address=server_addr, on_message=on_message)
+    try:
+        alice.start()
+        bob.start()
+        alice.send("alice")
+        time.sleep(0.1)
+        bob.send("bob")
+        time.sleep(0.2)
+
+        report("sem abusador", *run_phase(alice, lat, args.seconds))
+
+        flood = subprocess.Popen(
+            [
+                sys.executable,
+                __file__,
+                "--abuser",
+                "--port",
+                str(args.port),
+                "--seconds",
+                str(args.seconds + 1),
+                "--rate",
+                str(args.rate),
+            ]
+        )
+        time.sleep(0.5)
+        report("com abusador", *run_phase(alice, lat, args.seconds))
+        flood.wait()
+    finally:
+        alice.close()
+        bob.close()
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+# bench/bench_startup.py
+# Mede o custo de partida dos pontos de entrada:
+#   1. tempo de import (soma do -X importtime) de UDPClient e UDPServer;
+#   2. tempo até o primeiro pacote de um cliente novo, subindo um processo
+#      Python por cliente versus criando bots no mesmo processo (bots.py).
+#
+#   python bench/bench_startup.py --runs 10 --bots 20
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from socket import socket, timeout, AF_INET, SOCK_DGRAM
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+
+def import_time_ms(module):
+    """Tempo total de import (ms) reportado por python -X importtime."""
+    out = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+    ).stderr
+    for line in out.splitlines():
+        # "import time: self [us] | cumulative | imported package"
+        parts = line.split("|")
+        if len(parts) == 3 and parts[2].strip() == module:
+            return int(parts[1]) / 1000
+    raise RuntimeError(f"sem linha de import para {module}")
+
+
+def first_packet_spawn(sock, port):
+    """Sobe um processo cliente e espera o primeiro datagrama dele."""
+    code = (
+        "import UDPClient\n"
+        f"c = UDPClient.ChatClient(('127.0.0.1', {port}))\n"
+        "c.send('bot')\n"
+    )
+    t0 = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "-c", code], cwd=ROOT)
+    sock.recvfrom(65535)
+    elapsed = time.perf_counter() - t0
+    proc.wait()
+    return elapsed
+
+
+def first_packet_inproc(sock, port, n):
+    """Cria n bots no processo atual e espera o primeiro datagrama de cada um."""
+    import bots
+
+    bots.STAGGER = 0.0
+    t0 = time.perf_counter()
+    clients = bots.start_bots(n, ("127.0.0.1", port))
+    for _ in range(n):
+        sock.recvfrom(65535)
+    elapsed = time.perf_counter() - t0
+    for c in clients:
+        c.close()
+    return elapsed / n
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--runs", type=int, default=10)
+    ap.add_argument("--bots", type=int, default=20)
+    args = ap.parse_args()
+
+    for module in ("UDPClient", "UDPServer"):
+        samples = [import_time_ms(module) for _ in range(args.runs)]
+        print(f"import {module}: mediana {statistics.median(samples):.1f} ms")
+
+    sock = socket(AF_INET, SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    sock.settimeout(5)
+    port = sock.getsockname()[1]
+    try:
+        spawn = [first_packet_spawn(sock, port) * 1000 for _ in range(args.runs)]
+        inproc = first_packet_inproc(sock, port, args.bots) * 1000
+    except timeout:
+        print("nenhum pacote recebido")
+        return
+    finally:
+        sock.close()
+
+    print(f"1º pacote, processo por cliente: mediana {statistics.median(spawn):.1f} ms")
+    print(f"1º pacote, bot no mesmo processo: média {inproc:.2f} ms por bot")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+# bots.py
+# Sobe N clientes de chat (bots) num único interpretador, em vez de um
+# processo Python por bot: o custo de partida (interpretador + imports) é pago
+# uma vez só. Cada bot entra como bot<i> e manda mensagens na taxa pedida.
+#
+#   python bots.py -n 50 --rate 2 --seconds 30
+
+import argparse
+import os
+import threading
+import time
+
+from UDPClient import ChatClient, SERVER_NAME, SERVER_PORT
+
+STAGGER = 0.01  # intervalo entre a partida de um bot e o próximo
+
+
+def start_bots(n, server_address, key=None, on_message=None):
+    """Cria, inicia e registra n bots. Retorna a lista de ChatClient."""
+    bots = []
+    for i in range(n):
+        client = ChatClient(server_address, on_message=on_message, key=key)
+        client.start()
+        client.send(f"bot{i}")  # primeira mensagem = username
+        bots.append(client)
+        time.sleep(STAGGER)  # evita rajada de logins no servidor
+    return bots
+
+
+def run(bots, rate, seconds):
+    """Cada bot envia `rate` mensagens/s até o prazo; retorna o total enviado."""
+    deadline = time.monotonic() + seconds
+    sent = [0] * len(bots)
+
+    def loop(i, client):
+        interval = 1.0 / rate
+        next_at = time.monotonic()
+        while time.monotonic() < deadline:
+            if client.send(f"oi {sent[i]}"):
+                sent[i] += 1
+            next_at += interval
+            time.sleep(max(0.0, next_at - time.monotonic()))
+
+    threads = [
+        threading.Thread(target=loop, args=(i, c), daemon=True)
+        for i, c in enumerate(bots)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return sum(sent)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Bots de chat num só processo")
+    ap.add_argument("-n", type=int, default=10, help="quantidade de bots")
+    ap.add_argument("--host", default=SERVER_NAME)
+    ap.add_argument("--port", type=int, default=SERVER_PORT)
+    ap.add_argument("--rate", type=float, default=1.0, help="msgs/s por bot")
+    ap.add_argument("--seconds", type=float, default=10.0)
+    args = ap.parse_args()
+
+    chat_key = os.environ.get("CHAT_KEY")
+    t0 = time.perf_counter()
+    bots = start_bots(
+        args.n, (args.host, args.port), key=chat_key.encode() if chat_key else None
+    )
+    print(f"{args.n} bots no ar em {(time.perf_counter() - t0) * 1000:.1f} ms")
+    try:
+        total = run(bots, args.rate, args.seconds) if args.rate > 0 else 0
+        print(f"{total} mensagens enviadas")
+    except KeyboardInterrupt:
+        print("\nInterrompido.")
+    finally:
+        for client in bots:
+            client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,26 @@
 # interface/app.py
-import os, sys, threading, subprocess, queue, json, datetime
+import os, sys, threading, queue, json, datetime, time
 import customtkinter as ctk
 import tkinter.messagebox as mbox
 
-CLIENT_SCRIPT = os.path.join(os.path.dirname(__file__), "..", "UDPClient.py")
+# O motor do cliente roda no mesmo processo (UDPClient.py fica na raiz)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from UDPClient import ChatClient
+
 USERS_FILE = os.path.join(os.path.dirname(__file__), "users.json")
 
+# Janela de mensagens: só as últimas N linhas ficam no textbox
+MAX_RENDERED_LINES = 2000
+FLUSH_INTERVAL_MS = 16  # ~1 frame a 60 Hz
+
+# Fila entre a thread leitora e o Tk
+QUEUE_MAXSIZE = 1000  # cheia → a thread receptora bloqueia (back-pressure)
+DRAIN_BUDGET_MS = 8  # tempo máximo de processamento por tick do Tk
+
+# Presença
+ROSTER_REFRESH_MS = 250  # redesenho coalescido da lista de online
+TYPING_IDLE_MS = 3000  # sem teclar por esse tempo → "parou de digitar"
+
 
 # ---------- utils de usuário ----------
 def save_user(username: str):
@@ -37,6 +52,93 @@ def clear_user():
         pass
 
 
+# ---------- instrumentação ----------
+class LatencyStats:
+    """Latência recepção no cliente → render na tela (em ms)."""
+
+    def __init__(self):
+        self.count = 0
+        self.last = 0.0
+        self.max = 0.0
+        self.avg = 0.0  # média móvel exponencial
+
+    def record(self, seconds: float):
+        ms = seconds * 1000.0
+        self.count += 1
+        self.last = ms
+        self.max = max(self.max, ms)
+        self.avg = ms if self.count == 1 else self.avg + (ms - self.avg) * 0.05
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "last_ms": self.last,
+            "avg_ms": self.avg,
+            "max_ms": self.max,
+        }
+
+
+# ---------- view de mensagens ----------
+class MessageView:
+    """
+    Janela virtualizada sobre o CTkTextbox.
+    - linhas novas vão para um buffer e são inseridas de uma vez por frame;
+    - o textbox guarda no máximo `max_lines` linhas (as mais antigas saem);
+    - o scroll é feito uma vez por flush, e só se o usuário estava no fim.
+    """
+
+    def __init__(self, textbox, max_lines: int = MAX_RENDERED_LINES, latency=None):
+        self.textbox = textbox
+        self.max_lines = max_lines
+        self.latency = latency
+        self._stamps = []  # instantes de leitura das linhas pendentes
+        self._pending = []  # blocos de texto terminados em "\n"
+        self._pending_lines = 0
+        self._lines = 0  # linhas atualmente no textbox
+        self._flush_scheduled = False
+
+    def append(self, text: str, t_read: float | None = None):
+        chunk = text + "\n"
+        self._pending.append(chunk)
+        if t_read is not None:
+            self._stamps.append(t_read)
+        self._pending_lines += chunk.count("\n")
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            self.textbox.after(FLUSH_INTERVAL_MS, self._flush)
+
+    def _flush(self):
+        self._flush_scheduled = False
+        if not self._pending:
+            return
+
+        pending, self._pending = self._pending, []
+        n_lines, self._pending_lines = self._pending_lines, 0
+
+        # Rajada maior que a janela: nem chega a ir para o textbox
+        while n_lines > self.max_lines and len(pending) > 1:
+            n_lines -= pending.pop(0).count("\n")
+
+        at_bottom = self.textbox.yview()[1] >= 0.999
+        self.textbox.insert("end", "".join(pending))
+        self._lines += n_lines
+
+        excess = self._lines - self.max_lines
+        if excess > 0:
+            self.textbox.delete("1.0", f"{excess + 1}.0")
+            self._lines -= excess
+
+        if at_bottom:
+            self.textbox.see("end")
+
+        if self._stamps:
+            if self.latency is not None:
+                now = time.perf_counter()
+                for t_read in self._stamps:
+                    self.latency.record(now - t_read)
+            self._stamps = []
+
+
 # -------------- telas ---------------
 class LoginScreen(ctk.CTk):
     def __init__(self):
@@ -108,6 +210,17 @@ class ChatInterface(ctk.CTk):
         self.room_btn = ctk.CTkButton(self.rooms, text="Sala geral", fg_color="gray25")
         self.room_btn.pack(fill="x", padx=6, pady=4)
 
+        # --- presença ---
+        self.online_label = ctk.CTkLabel(sidebar, text="Online", font=("", 14, "bold"))
+        self.online_label.pack(anchor="w", padx=12, pady=(0, 5))
+        self.online_box = ctk.CTkTextbox(sidebar, width=180, height=120)
+        self.online_box.pack(fill="x", padx=8, pady=(0, 8))
+        self.online_box.configure(state="disabled")
+        self._online = set()
+        self._typing_names = set()
+        self._roster_scheduled = False
+        self._typing_job = None
+
         # --- ÁREA DE TESTES (Adicionado) ---
         ctk.CTkLabel(sidebar, text="Opções de Teste", font=("", 14, "bold")).pack(
             anchor="w", padx=12, pady=(10, 5)
@@ -144,11 +257,15 @@ class ChatInterface(ctk.CTk):
         topbar.grid(row=0, column=1, sticky="ew", padx=(6, 10), pady=(10, 0))
         ctk.CTkLabel(
             topbar, text=f"Conectado como: {self.username}  •  {self.current_room}"
-        ).pack(anchor="w", padx=8, pady=8)
+        ).pack(side="left", anchor="w", padx=8, pady=8)
+        self.typing_label = ctk.CTkLabel(topbar, text="", text_color="gray60")
+        self.typing_label.pack(side="right", padx=8, pady=8)
 
         # mensagens
         self.output = ctk.CTkTextbox(self, width=600, height=360)
         self.output.grid(row=1, column=1, sticky="nsew", padx=(6, 10), pady=(10, 6))
+        self.latency = LatencyStats()
+        self.view = MessageView(self.output, latency=self.latency)
 
         # envio
         row = ctk.CTkFrame(self)
@@ -157,119 +274,186 @@ class ChatInterface(ctk.CTk):
         self.entry = ctk.CTkEntry(row, placeholder_text="Digite e pressione Enter")
         self.entry.grid(row=0, column=0, sticky="ew", padx=(0, 8), pady=6)
         self.entry.bind("<Return>", lambda _e: self.send_line())
+        self.entry.bind("<KeyRelease>", self._on_key)
         self.send_btn = ctk.CTkButton(row, text="Enviar", command=self.send_line)
         self.send_btn.grid(row=0, column=1, padx=(0, 4), pady=6)
 
-        # fila stdout do cliente
-        self._q = queue.Queue()
-        env = os.environ.copy()
-        env["PYTHONIOENCODING"] = "utf-8"
-
-        # processo cliente
-        self.proc = subprocess.Popen(
-            [sys.executable, "-u", CLIENT_SCRIPT],
-            stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True,
-            bufsize=1,
-            env=env,
+        # fila de eventos do cliente (limitada) + wakeup coalescido
+        self._q = queue.Queue(maxsize=QUEUE_MAXSIZE)
+        self._wake_lock = threading.Lock()
+        self._wake_pending = False
+        self.bind("<<ClientData>>", lambda _e: self._drain_queue())
+
+        # motor do cliente (thread receptora própria)
+        self.client = ChatClient(
+            on_message=self._on_client_message,
+            on_status=self._on_client_status,
+            on_presence=self._on_client_presence,
         )
-        try:
-            self.proc.stdin.write(f"{self.username}\n")
-            self.proc.stdin.flush()
-        except Exception as e:
-            self._append_line(f"[GUI] erro inicial ao enviar username: {e}")
-
-        self.reader_thread = threading.Thread(target=self._reader_loop, daemon=True)
-        self.reader_thread.start()
-        self.after(50, self._drain_queue)
+        self.client.start()
+        if not self.client.send(self.username):
+            self._append_line("[GUI] erro inicial ao enviar username")
 
         self.protocol("WM_DELETE_WINDOW", self._on_close)
         self._append_line(f"✅ Logado como {self.username}")
         self.after(120, lambda: self.entry.focus())
 
     # ------- handlers de teste -------
-    def _send_cmd(self, cmd: str):
-        if self.proc and self.proc.poll() is None:
-            try:
-                self.proc.stdin.write(cmd + "\n")
-                self.proc.stdin.flush()
-            except Exception as e:
-                print(f"Erro enviando comando: {e}")
-
     def toggle_error(self):
-        val = 1 if self.sw_err.get() else 0
-        self._send_cmd(f"///set_err {val}")
+        self.client.set_test_error(bool(self.sw_err.get()))
 
     def toggle_drop_pkt(self):
-        val = 1 if self.sw_drop_pkt.get() else 0
-        self._send_cmd(f"///set_drop_pkt {val}")
+        self.client.set_drop_packet(bool(self.sw_drop_pkt.get()))
 
     def toggle_drop_ack(self):
-        val = 1 if self.sw_drop_ack.get() else 0
-        self._send_cmd(f"///set_drop_ack {val}")
+        self.client.set_drop_ack(bool(self.sw_drop_ack.get()))
 
     # ------- formatação estilo “nchat” -------
     def format_ts(self, dt: datetime.datetime | None = None) -> str:
         dt = dt or datetime.datetime.now()
         return dt.strftime("%d %b %Y %H:%M")
 
-    def render_message(self, sender: str, text: str, delivered: bool = True):
+    def render_message(
+        self,
+        sender: str,
+        text: str,
+        delivered: bool = True,
+        t_read: float | None = None,
+    ):
         check = " ✓" if delivered else ""
         header = f"{sender} ({self.format_ts()}){check}"
-        self._append_line(header)
-        self._append_line(text)
-        self._append_line("")  # espaçamento
+        # um bloco só (cabeçalho, texto e linha de espaçamento)
+        self._append_line(f"{header}\n{text}\n", t_read)
 
-    # ------- helpers -------
-    def _append_line(self, text: str):
-        self.output.insert("end", text + "\n")
-        self.output.see("end")
+    def latency_stats(self) -> dict:
+        """Latência recepção → tela das mensagens recebidas até agora."""
+        return self.latency.snapshot()
 
-    def _reader_loop(self):
+    # ------- helpers -------
+    def _append_line(self, text: str, t_read: float | None = None):
+        self.view.append(text, t_read)
+
+    def _wakeup(self):
+        # Só um evento pendente por vez, não importa quantas linhas cheguem
+        with self._wake_lock:
+            if self._wake_pending:
+                return
+            self._wake_pending = True
         try:
-            for line in self.proc.stdout:
-                self._q.put(line.rstrip("\n"))
-        except Exception as e:
-            self._q.put(f"[GUI] erro lendo stdout: {e}")
+            self.event_generate("<<ClientData>>", when="tail")
+        except Exception:
+            # janela destruída ou mainloop ainda não rodando: sem evento não
+            # há drain, então libera o próximo _wakeup para tentar de novo
+            with self._wake_lock:
+                self._wake_pending = False
+
+    # Callbacks do ChatClient: só enfileiram e acordam o Tk.
+    def _on_client_message(self, sender: str, text: str):
+        self._enqueue(("msg", sender, text, time.perf_counter()))
+
+    def _on_client_status(self, text: str):
+        self._enqueue(("status", None, text, time.perf_counter()))
+
+    def _on_client_presence(self, deltas):
+        self._enqueue(("presence", None, deltas, None))
+
+    def _enqueue(self, item):
+        # Na thread receptora o put bloqueia (back-pressure); na thread do Tk
+        # (ex.: toggles de teste) bloquear travaria o próprio drain.
+        if threading.current_thread() is threading.main_thread():
+            try:
+                self._q.put_nowait(item)
+            except queue.Full:
+                return
+        else:
+            self._q.put(item)
+        self._wakeup()
 
     def _drain_queue(self):
-        try:
-            while True:
-                raw = self._q.get_nowait()
-
-                prefix = "💬 Servidor respondeu: "
-                payload = raw[len(prefix) :].strip() if raw.startswith(prefix) else raw
-
-                if "|" in payload and not raw.startswith("["):
-                    # [TEST] ou [SISTEMA] não devem ser tratados como msg de chat
-                    parts = payload.split("|", 1)
-                    if len(parts) == 2:
-                        nome, msg = parts
-                        self.render_message(
-                            sender=(nome.strip() or "desconhecido"),
-                            text=msg.strip(),
-                            delivered=True,
-                        )
-                        continue
-
-                self._append_line(payload)
-        except queue.Empty:
-            pass
-        self.after(50, self._drain_queue)
+        # O flag fica ligado enquanto a cadeia de drain existir; assim os
+        # _wakeup do meio do caminho não abrem cadeias paralelas.
+        deadline = time.perf_counter() + DRAIN_BUDGET_MS / 1000.0
+        while time.perf_counter() < deadline:
+            try:
+                kind, sender, data, t_read = self._q.get_nowait()
+            except queue.Empty:
+                with self._wake_lock:
+                    self._wake_pending = False
+                # Reconfere: um produtor pode ter enfileirado depois do get
+                # vazio e desistido de acordar porque o flag ainda estava ligado.
+                if self._q.empty():
+                    return
+                with self._wake_lock:
+                    if self._wake_pending:
+                        return  # outro _wakeup já agendou o próximo drain
+                    self._wake_pending = True
+                continue
+            if kind == "msg":
+                self.render_message(sender, data, delivered=True, t_read=t_read)
+            elif kind == "presence":
+                self._apply_presence(data)
+            else:
+                self._append_line(data, t_read)
+
+        # Estourou o orçamento: devolve o controle ao Tk e continua no próximo tick
+        self.after(1, self._drain_queue)
+
+    # ------- presença -------
+    def _apply_presence(self, deltas):
+        for op, name in deltas:
+            if op == "+":
+                self._online.add(name)
+            elif op == "-":
+                self._online.discard(name)
+                self._typing_names.discard(name)
+            elif op == "*":
+                self._typing_names.add(name)
+            elif op == ".":
+                self._typing_names.discard(name)
+        if not self._roster_scheduled:
+            self._roster_scheduled = True
+            self.after(ROSTER_REFRESH_MS, self._render_roster)
+
+    def _render_roster(self):
+        self._roster_scheduled = False
+        self.online_label.configure(text=f"Online ({len(self._online)})")
+        self.online_box.configure(state="normal")
+        self.online_box.delete("1.0", "end")
+        self.online_box.insert("end", "\n".join(f"● {n}" for n in sorted(self._online)))
+        self.online_box.configure(state="disabled")
+
+        others = sorted(self._typing_names - {self.username})
+        if not others:
+            self.typing_label.configure(text="")
+        elif len(others) == 1:
+            self.typing_label.configure(text=f"{others[0]} está digitando...")
+        else:
+            self.typing_label.configure(text=f"{len(others)} pessoas digitando...")
+
+    def _on_key(self, _e=None):
+        if not self.entry.get().strip():
+            self._stop_typing()
+            return
+        self.client.set_typing(True)
+        if self._typing_job is not None:
+            self.after_cancel(self._typing_job)
+        self._typing_job = self.after(TYPING_IDLE_MS, self._stop_typing)
+
+    def _stop_typing(self):
+        if self._typing_job is not None:
+            self.after_cancel(self._typing_job)
+            self._typing_job = None
+        self.client.set_typing(False)
 
     def send_line(self):
         msg = self.entry.get().strip()
-        if not msg or self.proc.poll() is not None:
+        if not msg:
             return
         try:
-            # CORREÇÃO: Enviar apenas a mensagem. O servidor já sabe quem é você.
-            # Antes era: to_send = f"{self.username}|{msg}"
-            to_send = msg
-
-            self.proc.stdin.write(to_send + "\n")
-            self.proc.stdin.flush()
+            # Envia apenas a mensagem. O servidor já sabe quem é você.
+            if not self.client.send(msg):
+                return  # janela cheia: o aviso chega via on_status
+            self._stop_typing()
 
             # eco local (mantém igual)
             self.render_message(sender=self.username, text=msg, delivered=True)
@@ -280,26 +464,14 @@ class ChatInterface(ctk.CTk):
     def _switch_user(self):
         try:
             clear_user()
-            if self.proc and self.proc.poll() is None:
-                try:
-                    self.proc.stdin.write("/quit\n")
-                    self.proc.stdin.flush()
-                except Exception:
-                    pass
-                self.proc.terminate()
+            self.client.close()
         finally:
             self.destroy()
             LoginScreen().mainloop()
 
     def _on_close(self):
         try:
-            if self.proc and self.proc.poll() is None:
-                try:
-                    self.proc.stdin.write("/quit\n")
-                    self.proc.stdin.flush()
-                except Exception:
-                    pass
-                self.proc.terminate()
+            self.client.close()
         finally:
             self.destroy()
 
@@ -0,0 +1,417 @@
+# persistence.py
+# Snapshot + journal (write-ahead) do estado de sessão do servidor.
+#
+# Arquivos em `directory`:
+#   snapshot.bin        "CSS1" | geração:4 | sessões:4 | sessão...   (struct)
+#   journal.<g>.bin     registros (len:4 | op:1 | addr | campos) gravados
+#                       depois do snapshot g
+# Recuperação: carrega o snapshot e reaplica os journals de geração >= g.
+# Formato binário próprio (struct), sem pickle: os arquivos vêm de um diretório
+# configurável e nunca viram objetos Python arbitrários.
+# O snapshot sai do caminho quente: com os.fork() o filho serializa a cópia
+# copy-on-write do processo; sem fork (Windows) as tabelas são copiadas
+# (cópia rasa) e serializadas numa thread.
+# Sessões paradas há mais de SESSION_TTL são descartadas na recuperação e
+# pelo servidor antes de cada snapshot (prune_idle).
+
+from __future__ import annotations
+import os
+import struct
+import threading
+
+from protocol import seq_add
+from presence import PRESENCE_TIMEOUT
+
+SNAPSHOT_FILE = "snapshot.bin"
+SNAPSHOT_INTERVAL = 30.0  # segundos entre snapshots
+# Sessão sem nenhum pacote por esse tempo é esquecida. Maior que o timeout de
+# presença: quem só perdeu alguns heartbeats não perde o estado de SEQ.
+SESSION_TTL = 4 * PRESENCE_TIMEOUT
+TOUCH_INTERVAL = SESSION_TTL / 4  # no máx. um registro "T" por cliente nesse tempo
+
+_MAGIC = b"CSS1"
+_LEN = struct.Struct(">I")
+_U8 = struct.Struct(">B")
+_U16 = struct.Struct(">H")
+_U32 = struct.Struct(">I")
+_TIME = struct.Struct(">d")
+_PAIR = struct.Struct(">II")
+_SNAP_HEAD = struct.Struct(">4sII")  # magic, geração, nº de sessões
+# last_seen, esperado, lastAck, versão, próximo SEQ de saída
+_SESSION = struct.Struct(">dIIBI")
+_NO_NAME = 0xFFFF
+
+# Tabelas persistidas (nome → dict no servidor)
+TABLES = (
+    "clients",
+    "expectedNumberSequence",
+    "lastAck",
+    "usernames",
+    "peer_version",
+    "forward_buffer",
+    "server_seq_out",
+)
+
+
+def _journal_name(generation: int) -> str:
+    return f"journal.{generation}.bin"
+
+
+# ------- codificação -------
+def _pack_addr(addr) -> bytes:
+    ip = addr[0].encode()
+    return _U8.pack(len(ip)) + ip + _U16.pack(addr[1])
+
+
+def _unpack_addr(data: bytes, pos: int):
+    size = data[pos]
+    ip = data[pos + 1 : pos + 1 + size].decode()
+    (port,) = _U16.unpack_from(data, pos + 1 + size)
+    return (ip, port), pos + 3 + size
+
+
+def _pack_str(text: str | None) -> bytes:
+    if text is None:
+        return _U16.pack(_NO_NAME)
+    raw = text.encode()[: _NO_NAME - 1]
+    return _U16.pack(len(raw)) + raw
+
+
+def _unpack_str(data: bytes, pos: int):
+    (size,) = _U16.unpack_from(data, pos)
+    pos += _U16.size
+    if size == _NO_NAME:
+        return None, pos
+    return data[pos : pos + size].decode(errors="replace"), pos + size
+
+
+def encode_record(op: str, addr, *args) -> bytes:
+    """Registro do journal (sem o prefixo de tamanho)."""
+    head = op.encode() + _pack_addr(addr)
+    if op in ("N", "T"):
+        return head + _TIME.pack(args[0])
+    if op == "V":
+        return head + _U8.pack(args[0])
+    if op == "L":
+        return head + _pack_str(args[0])
+    if op == "R":
+        return head + _PAIR.pack(*args)
+    if op == "F":
+        return head + _U32.pack(args[0]) + args[1]
+    if op == "A":
+        return head + _U32.pack(args[0])
+    if op == "D":
+        return head
+    raise ValueError(f"registro desconhecido: {op!r}")
+
+
+def decode_record(data: bytes) -> tuple:
+    op = chr(data[0])
+    addr, pos = _unpack_addr(data, 1)
+    if op in ("N", "T"):
+        return (op, addr, _TIME.unpack_from(data, pos)[0])
+    if op == "V":
+        return (op, addr, data[pos])
+    if op == "L":
+        return (op, addr, _unpack_str(data, pos)[0])
+    if op == "R":
+        return (op, addr, *_PAIR.unpack_from(data, pos))
+    if op == "F":
+        return (op, addr, _U32.unpack_from(data, pos)[0], data[pos + _U32.size :])
+    if op == "A":
+        return (op, addr, _U32.unpack_from(data, pos)[0])
+    if op == "D":
+        return (op, addr)
+    raise ValueError(f"registro desconhecido: {op!r}")
+
+
+def encode_snapshot(tables: dict, generation: int) -> bytes:
+    clients = tables["clients"]
+    parts = [_SNAP_HEAD.pack(_MAGIC, generation, len(clients))]
+    for addr, last_seen in clients.items():
+        buffer = tables["forward_buffer"].get(addr, {})
+        parts.append(_pack_addr(addr))
+        parts.append(
+            _SESSION.pack(
+                last_seen,
+                tables["expectedNumberSequence"].get(addr, 1),
+                tables["lastAck"].get(addr, 0),
+                tables["peer_version"].get(addr, 1),
+                tables["server_seq_out"].get(addr, 1),
+            )
+        )
+        parts.append(_pack_str(tables["usernames"].get(addr)))
+        parts.append(_U32.pack(len(buffer)))
+        for seq, item in buffer.items():
+            parts.append(_PAIR.pack(seq, len(item["pkt"])))
+            parts.append(item["pkt"])
+    return b"".join(parts)
+
+
+def decode_snapshot(data: bytes) -> tuple[dict, int]:
+    magic, generation, count = _SNAP_HEAD.unpack_from(data, 0)
+    if magic != _MAGIC:
+        raise ValueError("snapshot em formato desconhecido")
+    tables = {name: {} for name in TABLES}
+    pos = _SNAP_HEAD.size
+    for _ in range(count):
+        addr, pos = _unpack_addr(data, pos)
+        last_seen, expected, ack, version, seq_out = _SESSION.unpack_from(data, pos)
+        pos += _SESSION.size
+        name, pos = _unpack_str(data, pos)
+        (pending,) = _U32.unpack_from(data, pos)
+        pos += _U32.size
+        buffer = {}
+        for _ in range(pending):
+            seq, size = _PAIR.unpack_from(data, pos)
+            pos += _PAIR.size
+            # Reenviado logo após a recuperação (como os registros "F")
+            buffer[seq] = {
+                "pkt": data[pos : pos + size],
+                "time": 0.0,
+                "first": 0.0,
+                "sent": True,
+            }
+            pos += size
+        tables["clients"][addr] = last_seen
+        tables["expectedNumberSequence"][addr] = expected
+        tables["lastAck"][addr] = ack
+        tables["peer_version"][addr] = version
+        tables["server_seq_out"][addr] = seq_out
+        tables["forward_buffer"][addr] = buffer
+        if name is not None:
+            tables["usernames"][addr] = name
+    return tables, generation
+
+
+class StateStore:
+    """
+    Journal + snapshots periódicos. Uso no servidor:
+    - load() no início → tabelas recuperadas (ou None)
+    - log(op, *args) a cada mudança de estado; commit() antes de responder
+    - touch(addr, now) a cada pacote (grava last_seen com folga)
+    - maybe_snapshot(tables, now) uma vez por volta do laço
+    """
+
+    def __init__(self, directory: str, snapshot_interval: float = SNAPSHOT_INTERVAL):
+        self.directory = directory
+        self.snapshot_interval = snapshot_interval
+        os.makedirs(directory, exist_ok=True)
+        self.generation = 0
+        self._journal = None
+        self._last_snapshot = 0.0
+        self._touched = {}  # addr → último last_seen gravado
+        self._child = None  # pid do filho que grava o snapshot
+        self._writer = None  # thread que grava o snapshot (sem fork)
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    # ------- recuperação -------
+    def load(self, ttl: float = SESSION_TTL) -> dict | None:
+        tables = None
+        generation = 0
+        try:
+            with open(self._path(SNAPSHOT_FILE), "rb") as f:
+                tables, generation = decode_snapshot(f.read())
+        except FileNotFoundError:
+            pass
+
+        journals = sorted(
+            g for g in self._generations() if g >= generation
+        )  # só o que veio depois do snapshot
+        for g in journals:
+            for record in self._read_journal(g):
+                if tables is None:
+                    tables = {name: {} for name in TABLES}
+                apply_record(tables, record)
+
+        # Continua numa geração nova, sem reescrever journals antigos
+        self.generation = max([generation, *journals], default=0) + 1
+        self._journal = open(self._path(_journal_name(self.generation)), "ab")
+
+        if tables is not None and tables["clients"]:
+            # Ociosidade medida até a última atividade registrada, não até
+            # agora: uma parada longa do servidor não apaga quem estava ativo.
+            prune_idle(tables, max(tables["clients"].values()), ttl)
+        return tables
+
+    def _generations(self) -> list[int]:
+        out = []
+        for name in os.listdir(self.directory):
+            parts = name.split(".")
+            if len(parts) == 3 and parts[0] == "journal" and parts[1].isdigit():
+                out.append(int(parts[1]))
+        return out
+
+    def _read_journal(self, generation: int):
+        with open(self._path(_journal_name(generation)), "rb") as f:
+            data = f.read()
+        pos = 0
+        while pos + _LEN.size <= len(data):
+            (size,) = _LEN.unpack_from(data, pos)
+            start = pos + _LEN.size
+            if start + size > len(data):
+                break  # registro cortado no meio (queda durante a escrita)
+            yield decode_record(data[start : start + size])
+            pos = start + size
+
+    # ------- journal -------
+    def log(self, *record):
+        raw = encode_record(*record)
+        self._journal.write(_LEN.pack(len(raw)) + raw)
+        if record[0] == "D":
+            self._touched.pop(record[1], None)
+
+    def touch(self, addr, now: float):
+        """Registra last_seen de addr, no máximo uma vez por TOUCH_INTERVAL."""
+        if now - self._touched.get(addr, 0.0) >= TOUCH_INTERVAL:
+            self._touched[addr] = now
+            self.log("T", addr, now)
+
+    def commit(self):
+        """Empurra o journal para o SO (sobrevive à queda do processo)."""
+        self._journal.flush()
+
+    # ------- snapshot -------
+    def maybe_snapshot(self, tables: dict, now: float):
+        if now - self._last_snapshot < self.snapshot_interval or self._busy():
+            return
+        self._last_snapshot = now
+
+        # Fecha a geração atual: o snapshot cobre tudo até aqui
+        self.commit()
+        self._journal.close()
+        self.generation += 1
+        self._journal = open(self._path(_journal_name(self.generation)), "ab")
+        generation = self.generation
+
+        if hasattr(os, "fork"):
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    self._write_snapshot(tables, generation)
+                finally:
+                    os._exit(0)
+            self._child = pid
+        else:
+            copy = {
+                name: (
+                    {k: dict(v) for k, v in t.items()}
+                    if name == "forward_buffer"
+                    else dict(t)
+                )
+                for name, t in tables.items()
+            }
+            self._writer = threading.Thread(
+                target=self._write_snapshot, args=(copy, generation), daemon=True
+            )
+            self._writer.start()
+
+    def _busy(self) -> bool:
+        if self._child is not None:
+            pid, _status = os.waitpid(self._child, os.WNOHANG)
+            if pid == 0:
+                return True
+            self._child = None
+        return self._writer is not None and self._writer.is_alive()
+
+    def _write_snapshot(self, tables: dict, generation: int):
+        tmp = self._path(SNAPSHOT_FILE + ".tmp")
+        with open(tmp, "wb") as f:
+            f.write(encode_snapshot(tables, generation))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._path(SNAPSHOT_FILE))
+        # Journals anteriores ao snapshot não são mais necessários
+        for g in self._generations():
+            if g < generation:
+                try:
+                    os.remove(self._path(_journal_name(g)))
+                except OSError:
+                    pass
+
+    def close(self):
+        if self._journal is not None:
+            self.commit()
+            self._journal.close()
+            self._journal = None
+
+
+class NullStore:
+    """StateStore desligado (servidor sem persistência)."""
+
+    def load(self):
+        return None
+
+    def log(self, *record):
+        pass
+
+    def touch(self, addr, now):
+        pass
+
+    def commit(self):
+        pass
+
+    def maybe_snapshot(self, tables, now):
+        pass
+
+    def close(self):
+        pass
+
+
+# ------- sessões ociosas -------
+def drop_session(tables: dict, addr):
+    for name in TABLES:
+        tables[name].pop(addr, None)
+
+
+def prune_idle(tables: dict, now: float, ttl: float = SESSION_TTL) -> list:
+    """Remove (inclusive o forward_buffer) quem está parado há mais de `ttl`."""
+    stale = [a for a, seen in tables["clients"].items() if now - seen > ttl]
+    for addr in stale:
+        drop_session(tables, addr)
+    return stale
+
+
+# ------- registros do journal -------
+# Cada registro é uma tupla (op, addr, *args):
+#   ("N", addr, now)            cliente novo
+#   ("T", addr, now)            último pacote visto (last_seen)
+#   ("V", addr, version)        versão negociada
+#   ("L", addr, nome)           login
+#   ("R", addr, esperado, ack)  DATA aceito em ordem
+#   ("F", dest, seq, pkt)       pacote encaminhado (entra no forward_buffer)
+#   ("A", dest, seq)            ACK do destino (sai do forward_buffer)
+#   ("D", addr)                 sessão ociosa descartada
+def apply_record(tables: dict, record: tuple):
+    op, addr, *args = record
+    if op == "N":
+        tables["clients"][addr] = args[0]
+        tables["expectedNumberSequence"].setdefault(addr, 1)
+        tables["lastAck"].setdefault(addr, 0)
+        tables["forward_buffer"].setdefault(addr, {})
+        tables["server_seq_out"].setdefault(addr, 1)
+    elif op == "T":
+        if addr in tables["clients"]:
+            tables["clients"][addr] = args[0]
+    elif op == "V":
+        tables["peer_version"][addr] = args[0]
+    elif op == "L":
+        tables["usernames"][addr] = args[0]
+    elif op == "R":
+        tables["expectedNumberSequence"][addr] = args[0]
+        tables["lastAck"][addr] = args[1]
+    elif op == "F":
+        seq, pkt = args
+        tables["forward_buffer"].setdefault(addr, {})[seq] = {
+            "pkt": pkt,
+            "time": 0.0,
+            "first": 0.0,
+            "sent": True,
+        }
+        tables["server_seq_out"][addr] = seq_add(seq)
+    elif op == "A":
+        tables["forward_buffer"].get(addr, {}).pop(args[0], None)
+    elif op == "D":
+        drop_session(tables, addr)
@@ -0,0 +1,139 @@
+# presence.py
+# Presença por sala: roster, "digitando..." e deltas compactos.
+#
+# Os eventos vão em pacotes FLAG_PRESENCE (seq=0, sem ACK, fora da janela).
+# Payload: linhas "<op><nome>" separadas por "\n", com op:
+#   "+" entrou/online   "-" saiu/offline   "*" digitando   "." parou de digitar
+# Cliente → servidor: b"T1" / b"T0" (digitando sim/não) na mudança, e a cada
+# HEARTBEAT_INTERVAL o heartbeat com o estado atual: b"T1" se digitando, senão
+# b"H" (vale como b"T0"). Assim um aviso perdido se corrige no próximo heartbeat.
+# O snapshot do roster para quem entra usa o mesmo formato (só linhas "+").
+
+from __future__ import annotations
+
+DEFAULT_ROOM = "geral"
+PRESENCE_TIMEOUT = 15.0  # sem pacotes por esse tempo → offline
+PRESENCE_FLUSH = 0.25  # intervalo de envio dos deltas acumulados
+PRESENCE_MTU = 1200  # bytes de payload por pacote de presença
+EXPIRE_INTERVAL = 1.0  # intervalo entre varreduras de expiração
+
+OP_ONLINE = "+"
+OP_OFFLINE = "-"
+OP_TYPING = "*"
+OP_IDLE = "."
+
+HEARTBEAT = b"H"
+TYPING_ON = b"T1"
+TYPING_OFF = b"T0"
+
+
+def encode_chunks(lines: list[str], mtu: int = PRESENCE_MTU) -> list[bytes]:
+    """Agrupa linhas em payloads de até `mtu` bytes."""
+    chunks = []
+    cur = []
+    size = 0
+    for line in lines:
+        raw = line.encode()
+        if cur and size + 1 + len(raw) > mtu:
+            chunks.append(b"\n".join(cur))
+            cur, size = [], 0
+        cur.append(raw)
+        size += len(raw) + (1 if size else 0)
+    if cur:
+        chunks.append(b"\n".join(cur))
+    return chunks
+
+
+def decode_deltas(payload: bytes) -> list[tuple[str, str]]:
+    """Payload de presença → [(op, nome), ...]."""
+    out = []
+    for line in payload.decode(errors="ignore").split("\n"):
+        if len(line) > 1:
+            out.append((line[0], line[1:]))
+    return out
+
+
+class PresenceHub:
+    """
+    Roster por sala com deltas coalescidos.
+    Eventos só mudam dicionários pendentes (último estado por nome vence);
+    flush() gera um lote por sala a cada PRESENCE_FLUSH, então o custo é
+    O(membros × pacotes do lote) por intervalo, e não por evento. Quem entrou
+    no intervalo recebe o snapshot do roster, montado uma vez por sala.
+    """
+
+    def __init__(self, timeout: float = PRESENCE_TIMEOUT, mtu: int = PRESENCE_MTU):
+        self.timeout = timeout
+        self.mtu = mtu
+        self.rooms: dict[str, dict] = {}  # sala → {addr: nome}
+        self.room_of: dict = {}  # addr → sala
+        self._roster_delta: dict[str, dict[str, str]] = {}  # sala → {nome: op}
+        self._typing_delta: dict[str, dict[str, str]] = {}
+        self._typing: set = set()  # addrs digitando agora
+        self._joiners: dict[str, list] = {}  # sala → addrs aguardando snapshot
+        self._last_expire = 0.0
+
+    def join(self, addr, name: str, room: str = DEFAULT_ROOM):
+        """Coloca addr na sala; o snapshot do roster sai no próximo flush()."""
+        if self.room_of.get(addr) == room:
+            return
+        self.leave(addr)
+        self.rooms.setdefault(room, {})[addr] = name
+        self.room_of[addr] = room
+        self._roster_delta.setdefault(room, {})[name] = OP_ONLINE
+        self._joiners.setdefault(room, []).append(addr)
+
+    def leave(self, addr):
+        room = self.room_of.pop(addr, None)
+        if room is None:
+            return
+        name = self.rooms[room].pop(addr)
+        if not self.rooms[room]:
+            del self.rooms[room]
+        self._typing.discard(addr)
+        self._roster_delta.setdefault(room, {})[name] = OP_OFFLINE
+
+    def typing(self, addr, on: bool):
+        room = self.room_of.get(addr)
+        if room is None or (addr in self._typing) == on:
+            return
+        if on:
+            self._typing.add(addr)
+        else:
+            self._typing.discard(addr)
+        name = self.rooms[room][addr]
+        self._typing_delta.setdefault(room, {})[name] = OP_TYPING if on else OP_IDLE
+
+    def expire(self, last_seen: dict, now: float):
+        """Marca offline quem não manda nada há mais de `timeout` segundos."""
+        if now - self._last_expire < EXPIRE_INTERVAL:
+            return
+        self._last_expire = now
+        stale = [a for a in self.room_of if now - last_seen.get(a, 0.0) > self.timeout]
+        for addr in stale:
+            self.leave(addr)
+
+    def flush(self) -> list[tuple[list, list[bytes]]]:
+        """Lotes pendentes: [(destinatários, payloads), ...]."""
+        out = []
+        fresh = set()  # já recebem o estado completo no snapshot
+        for room, joiners in self._joiners.items():
+            members = self.rooms.get(room, {})
+            joiners = [a for a in joiners if a in members]
+            if joiners:
+                snapshot = [OP_ONLINE + n for n in members.values()]
+                snapshot += [
+                    OP_TYPING + members[a] for a in self._typing if a in members
+                ]
+                out.append((joiners, encode_chunks(snapshot, self.mtu)))
+                fresh.update(joiners)
+        for room in set(self._roster_delta) | set(self._typing_delta):
+            lines = [op + n for n, op in self._roster_delta.get(room, {}).items()]
+            lines += [op + n for n, op in self._typing_delta.get(room, {}).items()]
+            members = [a for a in self.rooms.get(room, ()) if a not in fresh]
+            if lines and members:
+                out.append((members, encode_chunks(lines, self.mtu)))
+        self._joiners.clear()
+        self._roster_delta.clear()
+        self._typing_delta.clear()
+        return out
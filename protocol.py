@@ -1,15 +1,33 @@
 # protocol.py
 # Cabeçalho da camada de aplicação (nosso “mini TCP” sobre UDP)
-# Layout (big-endian, 18 bytes fixos):
+# Versão 1 (big-endian, 16 bytes fixos):
 # | version:1 | flags:1 | seq:4 | ack:4 | win:2 | len:2 | checksum:2 | + payload(len) |
+# Versão 2 (big-endian, 18 bytes fixos, +8 de MAC se FLAG_AUTH):
+# | version:1 | flags:1 | seq:4 | ack:4 | win:2 | len:2 | crc32:4 | [mac:8] | + payload(len) |
+# - crc32 = zlib.crc32(header sem crc/mac, zlib.crc32(payload)): o payload
+#   entra primeiro, então o CRC de um corpo compartilhado é calculado uma vez.
+# - mac = HMAC-SHA256(chave, payload + header sem crc/mac)[:8], só em sessões
+#   autenticadas (chave compartilhada).
+# Negociação: cada lado responde na versão do último pacote válido do peer.
 
 from __future__ import annotations
+from array import array
 import struct
+import sys
+import zlib
 
 # Formatos binários (big-endian / network order)
 _HDR_NO_CSUM = ">BBIIHH"  # version, flags, seq, ack, win, len
 _HDR_FULL = ">BBIIHHH"  # + checksum (H)
-HEADER_SIZE = struct.calcsize(_HDR_FULL)  # 18 bytes
+_HDR_FULL_V2 = ">BBIIHHI"  # + crc32 (I)
+HEADER_SIZE = struct.calcsize(_HDR_FULL)  # 16 bytes
+HEADER_SIZE_V2 = struct.calcsize(_HDR_FULL_V2)  # 18 bytes
+MAC_SIZE = 8  # HMAC-SHA256 truncado
+
+# Versões do cabeçalho
+PROTOCOL_V1 = 1
+PROTOCOL_V2 = 2
+PROTOCOL_VERSION = PROTOCOL_V2  # maior versão suportada
 
 # Flags (bitmask)
 FLAG_DATA = 0x01  # 0000 0001 → pacote contém dados
@@ -17,21 +35,88 @@ FLAG_ACK = 0x02  # 0000 0010 → pacote é ACK
 FLAG_TEST_DROP_PKT = 0x04  # 0000 0100 → modo de teste: descartar pacotes
 FLAG_TEST_DROP_ACK = 0x08  # 0000 1000 → modo de teste: descartar ACKs
 FLAG_TEST_ERR = 0x10  # 0001 0000 → modo de teste: corromper pacote
+FLAG_AUTH = 0x20  # 0010 0000 → (v2) header carrega MAC
+FLAG_PRESENCE = 0x40  # 0100 0000 → presença/digitando (sem SEQ, sem ACK)
+FLAG_RESET = 0x80  # 1000 0000 → servidor não conhece a sessão: refazer login
 
 # Janela padrão do emissor (pode ser sobrescrita por linha de comando, etc.)
 WINDOW_SIZE = 5
 
+# Espaço de números de sequência (campo seq de 32 bits)
+SEQ_MOD = 1 << 32
 
-def internet_checksum(data: bytes) -> int:
-    """Internet checksum 16-bit (one's complement) sobre data."""
+
+def seq_add(seq: int, n: int = 1) -> int:
+    """seq + n com wraparound em 32 bits."""
+    return (seq + n) % SEQ_MOD
+
+
+def seq_diff(a: int, b: int) -> int:
+    """Distância com sinal a - b no espaço circular (serial number arithmetic)."""
+    d = (a - b) % SEQ_MOD
+    return d - SEQ_MOD if d >= SEQ_MOD // 2 else d
+
+
+def payload_sum(data: bytes) -> int:
+    """
+    Soma 16-bit (mod 2^16) das palavras big-endian de data.
+    Como o header sem checksum tem tamanho par, a soma de um pacote é
+    soma(header) + soma(payload): dá para calcular a do payload uma vez só.
+    """
     # padding se tamanho ímpar
     if len(data) & 1:
         data += b"\x00"
-    s = 0
-    for i in range(0, len(data), 2):
-        w = (data[i] << 8) | data[i + 1]
-        s = (s + w) & 0xFFFF
-    return (~s) & 0xFFFF
+    words = array("H", data)
+    if sys.byteorder == "little":
+        words.byteswap()
+    return sum(words) & 0xFFFF
+
+
+def internet_checksum(data: bytes) -> int:
+    """Internet checksum 16-bit (one's complement) sobre data."""
+    return (~payload_sum(data)) & 0xFFFF
+
+
+def body_checksum(body: bytes, version: int = PROTOCOL_V1) -> int:
+    """Parte do checksum que depende só do payload (entrada de pack_header)."""
+    if version == PROTOCOL_V1:
+        return payload_sum(body)
+    return zlib.crc32(body)
+
+
+def _mac(key: bytes, payload: bytes, header_no_csum: bytes) -> bytes:
+    # Import tardio: só sessões autenticadas pagam o custo do hashlib
+    import hashlib
+    import hmac
+
+    return hmac.new(key, payload + header_no_csum, hashlib.sha256).digest()[:MAC_SIZE]
+
+
+def pack_header(
+    *,
+    version: int,
+    flags: int,
+    seq: int,
+    ack: int,
+    window_size: int = WINDOW_SIZE,
+    length: int,
+    body_sum: int,
+) -> bytes:
+    """
+    Monta só o header, a partir de len e do checksum já calculado do payload
+    (body_checksum). Serve para reaproveitar o mesmo corpo em vários pacotes.
+    Não cobre sessões autenticadas (o MAC depende do pacote inteiro).
+    """
+    header_no_csum = struct.pack(
+        _HDR_NO_CSUM, version, flags, seq, ack, window_size, length
+    )
+    if version == PROTOCOL_V1:
+        csum = (~(payload_sum(header_no_csum) + body_sum)) & 0xFFFF
+        return struct.pack(
+            _HDR_FULL, version, flags, seq, ack, window_size, length, csum
+        )
+    crc = zlib.crc32(header_no_csum, body_sum)
+    return struct.pack(_HDR_FULL_V2, version, flags, seq, ack, window_size, length, crc)
 
 
 def pack_packet(
@@ -42,29 +127,45 @@ def pack_packet(
     ack: int,
     window_size: int = WINDOW_SIZE,
     payload: bytes,
+    key: bytes | None = None,
 ) -> bytes:
     """
     Monta (header+payload) com checksum calculado.
     - len é derivado automaticamente do payload.
     - checksum é calculado sobre (header com checksum=0) + payload.
+    - com key (só v2), acrescenta FLAG_AUTH e o MAC truncado.
     """
     if not isinstance(payload, (bytes, bytearray)):
         raise TypeError("payload deve ser bytes/bytearray")
+    if key is not None and version == PROTOCOL_V1:
+        raise ValueError("MAC exige protocolo versão 2")
 
     length = len(payload)
 
-    # 1) header sem checksum
-    header_no_csum = struct.pack(
-        _HDR_NO_CSUM, version, flags, seq, ack, window_size, length
-    )
-
-    # 2) checksum sobre header(sem csum) + payload
-    csum = internet_checksum(header_no_csum + payload)
-
-    # 3) header completo
-    header_full = struct.pack(
-        _HDR_FULL, version, flags, seq, ack, window_size, length, csum
-    )
+    if key is None:
+        # 1-3) header completo, checksum sobre header(sem csum) + payload
+        header_full = pack_header(
+            version=version,
+            flags=flags,
+            seq=seq,
+            ack=ack,
+            window_size=window_size,
+            length=length,
+            body_sum=body_checksum(payload, version),
+        )
+    else:
+        flags |= FLAG_AUTH
+        header_no_csum = struct.pack(
+            _HDR_NO_CSUM, version, flags, seq, ack, window_size, length
+        )
+        mac = _mac(key, payload, header_no_csum)
+        crc = zlib.crc32(header_no_csum, zlib.crc32(mac, zlib.crc32(payload)))
+        header_full = (
+            struct.pack(
+                _HDR_FULL_V2, version, flags, seq, ack, window_size, length, crc
+            )
+            + mac
+        )
 
     # 4) modo de teste: corromper propositalmente (se FLAG_TEST_ERR setada)
     if flags & FLAG_TEST_ERR and length > 0:
@@ -76,11 +177,16 @@ def pack_packet(
     return header_full + payload
 
 
-def unpack_packet(datagram: bytes) -> dict:
+def unpack_packet(datagram: bytes, key: bytes | None = None) -> dict:
     """
     Lê (header+payload) e retorna um dict com campos e validação do checksum.
+    A versão é lida do primeiro byte. Com key, o pacote só é válido
+    (checksum_ok) se for v2 com MAC correto.
     Lança ValueError se o datagrama for curto ou 'len' não bater.
     """
+    if datagram and datagram[0] >= PROTOCOL_V2:
+        return _unpack_v2(datagram, key)
+
     if len(datagram) < HEADER_SIZE:
         raise ValueError("datagrama menor que o tamanho do cabeçalho")
 
@@ -97,7 +203,7 @@ def unpack_packet(datagram: bytes) -> dict:
         _HDR_NO_CSUM, version, flags, seq, ack, window_size, length
     )
     expected = internet_checksum(header_no_csum + payload)
-    checksum_ok = expected == csum
+    checksum_ok = expected == csum and key is None
 
     return {
         "version": version,
@@ -110,3 +216,47 @@ def unpack_packet(datagram: bytes) -> dict:
         "checksum_ok": checksum_ok,
         "payload": payload,
     }
+
+
+def _unpack_v2(datagram: bytes, key: bytes | None) -> dict:
+    if len(datagram) < HEADER_SIZE_V2:
+        raise ValueError("datagrama menor que o tamanho do cabeçalho")
+
+    version, flags, seq, ack, window_size, length, crc = struct.unpack(
+        _HDR_FULL_V2, datagram[:HEADER_SIZE_V2]
+    )
+    offset = HEADER_SIZE_V2
+    mac = b""
+    if flags & FLAG_AUTH:
+        mac = datagram[offset : offset + MAC_SIZE]
+        offset += MAC_SIZE
+    payload = datagram[offset:]
+
+    if len(payload) != length:
+        raise ValueError(f"LEN={length} não bate com bytes de payload={len(payload)}")
+
+    header_no_csum = datagram[: HEADER_SIZE_V2 - 4]
+    checksum_ok = crc == zlib.crc32(
+        header_no_csum, zlib.crc32(mac, zlib.crc32(payload))
+    )
+    if checksum_ok and key is not None:
+        # Sessão autenticada: MAC obrigatório e correto
+        import hmac
+
+        checksum_ok = bool(mac) and hmac.compare_digest(
+            mac, _mac(key, payload, header_no_csum)
+        )
+    elif mac and key is None:
+        checksum_ok = False  # não há como verificar o MAC
+
+    return {
+        "version": version,
+        "flags": flags,
+        "seq": seq,
+        "ack": ack,
+        "win": window_size,
+        "len": length,
+        "checksum": crc,
+        "checksum_ok": checksum_ok,
+        "payload": payload,
+    }
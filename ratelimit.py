@@ -0,0 +1,60 @@
+# ratelimit.py
+# Token bucket por cliente e política de taxa do servidor.
+
+from __future__ import annotations
+
+
+class RatePolicy:
+    """
+    Limites por sessão (taxa em pacotes/s, rajada em pacotes).
+    Classe simples (sem dataclasses) para não pesar na partida do servidor.
+    """
+
+    def __init__(
+        self,
+        *,
+        inbound_rate: float = 50.0,  # DATA recebidos do cliente
+        inbound_burst: int = 20,
+        forward_rate: float = 100.0,  # DATA encaminhados/retransmitidos ao cliente
+        forward_burst: int = 40,
+        dupack_rate: float = 5.0,  # DUP-ACKs enviados ao cliente
+        dupack_burst: int = 5,
+        ack_rate: float = 400.0,  # ACKs puros recebidos (folgado: ~1 por DATA)
+        ack_burst: int = 100,
+        retx_burst: int = 4,  # máx. de retransmissões por destino a cada checagem
+        retx_interval: float = 0.5,  # intervalo entre checagens de retransmissão
+        forward_queue: int = 256,  # máx. de pacotes pendentes (enviados + adiados) por destino
+    ):
+        self.inbound_rate = inbound_rate
+        self.inbound_burst = inbound_burst
+        self.forward_rate = forward_rate
+        self.forward_burst = forward_burst
+        self.dupack_rate = dupack_rate
+        self.dupack_burst = dupack_burst
+        self.ack_rate = ack_rate
+        self.ack_burst = ack_burst
+        self.retx_burst = retx_burst
+        self.retx_interval = retx_interval
+        self.forward_queue = forward_queue
+
+
+class TokenBucket:
+    """Balde de fichas: `rate` fichas/s, no máximo `burst` acumuladas."""
+
+    __slots__ = ("rate", "burst", "tokens", "stamp")
+
+    def __init__(self, rate: float, burst: int, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.stamp = now
+
+    def take(self, now: float, n: int = 1) -> bool:
+        elapsed = now - self.stamp
+        if elapsed > 0:
+            self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+            self.stamp = now
+        if self.tokens >= n:
+            self.tokens -= n
+            return True
+        return False
@@ -0,0 +1,73 @@
+# sendwindow.py
+# Buffer circular da janela de envio (Go-Back-N).
+# Cada pacote em trânsito fica no slot seq % capacidade; base e next andam
+# no espaço circular de 32 bits do campo seq.
+
+from __future__ import annotations
+
+from protocol import seq_add, seq_diff
+
+
+class SendRing:
+    """
+    Janela de envio com capacidade fixa.
+    - reserve(): O(1), devolve o próximo SEQ (ou None se o buffer estiver cheio)
+    - ack(n): ACK cumulativo, libera os slots até n (O(pacotes liberados))
+    - pending(): pacotes ainda não confirmados, em ordem, para retransmissão
+    """
+
+    def __init__(self, capacity: int, first_seq: int = 1):
+        size = 1
+        while size < capacity:
+            size <<= 1
+        self.capacity = size
+        self._mask = size - 1
+        self._slots: list[bytes | None] = [None] * size
+        self.base = first_seq  # SEQ mais antigo não confirmado
+        self.next_seq = first_seq  # próximo SEQ a usar
+
+    def in_flight(self) -> int:
+        return seq_diff(self.next_seq, self.base)
+
+    def empty(self) -> bool:
+        return self.next_seq == self.base
+
+    def reserve(self) -> int | None:
+        if self.in_flight() >= self.capacity:
+            return None
+        seq = self.next_seq
+        self.next_seq = seq_add(seq)
+        return seq
+
+    def put(self, seq: int, pkt: bytes):
+        self._slots[seq & self._mask] = pkt
+
+    def get(self, seq: int) -> bytes | None:
+        return self._slots[seq & self._mask]
+
+    def ack(self, acknum: int) -> int | None:
+        """
+        Aplica ACK cumulativo de `acknum`.
+        Retorna quantos pacotes saíram da janela (0 = ACK duplicado) ou None
+        se o ACK estiver fora da janela (antigo ou de SEQ nunca enviado).
+        """
+        new_base = seq_add(acknum)
+        advanced = seq_diff(new_base, self.base)
+        if advanced < 0 or advanced > self.in_flight():
+            return None
+        seq = self.base
+        for _ in range(advanced):
+            self._slots[seq & self._mask] = None
+            seq = seq_add(seq)
+        self.base = new_base
+        return advanced
+
+    def pending(self) -> list[tuple[int, bytes]]:
+        out = []
+        seq = self.base
+        for _ in range(self.in_flight()):
+            pkt = self._slots[seq & self._mask]
+            if pkt is not None:
+                out.append((seq, pkt))
+            seq = seq_add(seq)
+        return out